@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES = os.path.join(BENCHMARK_DIR, 'baselines.json')
+DEFAULT_THRESHOLD = 1.5
+RING_SIZES = (100, 1000, 5000)
+
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+import standin
+
+standin.install()
+os.environ.setdefault('PYJMAD_CACHE_DIR', tempfile.mkdtemp(prefix='pyjmad-bench-'))
+
+import pyjmad
+from pyjmad.pyjmad import TfsResultRequestImpl, MadxTwissVariable, _jmad_TfsResult_to_pandas
+from pyjmad.matching import GlobalConstraint, Vary
+
+TWISS_VARIABLES = ('S', 'BETX', 'BETY', 'ALFX', 'ALFY', 'DX', 'X', 'Y', 'MUX', 'MUY')
+
+_benchmarks = OrderedDict()
+
+
+def benchmark(name, sizes=(None,), threshold=DEFAULT_THRESHOLD):
+    def register(setup):
+        for size in sizes:
+            key = name if size is None else name + '[' + str(size) + ']'
+            _benchmarks[key] = (setup, size, threshold)
+        return setup
+
+    return register
+
+
+def _model(cells):
+    standin.configure(cells)
+    return pyjmad.JMad().create_model('STANDIN RING')
+
+
+@benchmark('jmad_startup', threshold=2.0)
+def _jmad_startup(size):
+    return lambda: pyjmad.JMad(shared=False)
+
+
+@benchmark('jmad_startup_shared', threshold=2.0)
+def _jmad_startup_shared(size):
+    pyjmad.JMad()
+    return lambda: pyjmad.JMad()
+
+
+@benchmark('create_model', RING_SIZES)
+def _create_model(cells):
+    jmad = pyjmad.JMad()
+    standin.configure(cells)
+    return lambda: jmad.create_model('STANDIN RING')
+
+
+@benchmark('twiss', RING_SIZES)
+def _twiss(cells):
+    model = _model(cells)
+    return lambda: model.twiss(TWISS_VARIABLES, cache=False)
+
+
+@benchmark('twiss_cached', RING_SIZES, threshold=2.0)
+def _twiss_cached(cells):
+    model = _model(cells)
+    model.twiss(TWISS_VARIABLES)
+    return lambda: model.twiss(TWISS_VARIABLES)
+
+
+@benchmark('tfs_to_pandas', RING_SIZES)
+def _tfs_to_pandas(cells):
+    model = _model(cells)
+    request = TfsResultRequestImpl.createDefaultRequest()
+    for var in TWISS_VARIABLES:
+        request.addVariable(MadxTwissVariable._jmad_variable(var))
+    tfs_result = model._jmadModel.twiss(request)
+    return lambda: _jmad_TfsResult_to_pandas(tfs_result)
+
+
+@benchmark('strengths_iterate', RING_SIZES)
+def _strengths_iterate(cells):
+    model = _model(cells)
+    return lambda: dict(model.strengths.items())
+
+
+@benchmark('strengths_values_array', RING_SIZES)
+def _strengths_values_array(cells):
+    model = _model(cells)
+    return lambda: model.strengths.values_array()
+
+
+@benchmark('elements_construct', RING_SIZES)
+def _elements_construct(cells):
+    model = _model(cells)
+    jmadRange = model._jmadModel.getActiveRange()
+    return lambda: pyjmad.Elements(jmadRange)
+
+
+@benchmark('elements_slice', RING_SIZES)
+def _elements_slice(cells):
+    elements = _model(cells).elements
+    last = 'M.' + str(cells // 2)
+    return lambda: list(elements['MQ.1':last].values())
+
+
+@benchmark('attributes_read')
+def _attributes_read(size):
+    elements = _model(100).elements
+    quadrupoles = [elements['MQ.' + str(c)] for c in range(100)]
+    return lambda: [dict(q.attributes) for q in quadrupoles]
+
+
+@benchmark('element_typed_read')
+def _element_typed_read(size):
+    elements = _model(100).elements
+    quadrupoles = [elements['MQ.' + str(c)] for c in range(100)]
+    return lambda: [q.k1 for q in quadrupoles]
+
+
+@benchmark('attribute_array', RING_SIZES)
+def _attribute_array(cells):
+    model = _model(cells)
+    state = {'k1': 0.0087}
+
+    def read_after_write():
+        # a write invalidates the cached values, so every call reads the attribute of all quadrupoles again
+        state['k1'] = -state['k1']
+        model.elements['MQ.0'].k1 = state['k1']
+        return model.elements.attribute_array('k1')
+
+    return read_after_write
+
+
+@benchmark('set_attribute_array', RING_SIZES)
+def _set_attribute_array(cells):
+    elements = _model(cells).elements
+    k1 = elements.attribute_array('k1')
+    errors = np.random.RandomState(0).normal(0, 1e-5, len(k1))
+    return lambda: elements.set_attribute_array('k1', k1.index, k1.values + errors).undo()
+
+
+@benchmark('checkpoint_restore', RING_SIZES)
+def _checkpoint_restore(cells):
+    model = _model(cells)
+    snapshot = model.checkpoint()
+
+    def what_if():
+        model.strengths['on_x1'] = 150
+        model.elements['MQ.1'].k1 = 0.01
+        return model.restore(snapshot)
+
+    return what_if
+
+
+@benchmark('match_tunes')
+def _match_tunes(size):
+    model = _model(100)
+    targets = [(62.28, 60.31), (62.30, 60.32)]
+    state = {'i': 0}
+
+    def match():
+        state['i'] += 1
+        q1, q2 = targets[state['i'] % 2]
+        return model.match(GlobalConstraint(Q1=q1, Q2=q2), Vary('KQT4.L3'), Vary('KQT4.R3'))
+
+    return match
+
+
+def measure(fn, repeat, min_time):
+    start = time.perf_counter()
+    fn()
+    once = time.perf_counter() - start
+    number = max(1, int(min_time / max(once, 1e-9)))
+    timings = []
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return statistics.median(timings)
+
+
+def _join_background_threads():
+    for thread in threading.enumerate():
+        if thread.name.startswith('pyjmad-'):
+            thread.join()
+
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)['benchmarks']
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def save_baselines(path, results):
+    benchmarks = load_baselines(path)
+    benchmarks.update(results)
+    with open(path, 'w') as f:
+        json.dump({'version': 1,
+                   'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                                   'system': platform.system(), 'processor': platform.processor()},
+                   'benchmarks': OrderedDict(sorted(benchmarks.items()))}, f, indent=1)
+        f.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyjmad against an in-process JMad stand-in')
+    parser.add_argument('-k', '--filter', default='', help='only run benchmarks containing this string')
+    parser.add_argument('--repeat', type=int, default=7, help='number of timing repeats (the median counts)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum duration of one repeat [s]')
+    parser.add_argument('--baselines', default=BASELINES, help='baseline file')
+    parser.add_argument('--save', action='store_true', help='store the results as new baselines')
+    parser.add_argument('--threshold', type=float, default=None, help='override all regression thresholds')
+    args = parser.parse_args(argv)
+
+    baselines = load_baselines(args.baselines)
+    results = OrderedDict()
+    regressions = []
+    print('{:<32} {:>12} {:>12} {:>8}'.format('benchmark', 'time [ms]', 'baseline', 'ratio'))
+    for name, (setup, size, threshold) in _benchmarks.items():
+        if args.filter not in name:
+            continue
+        seconds = measure(setup(size), args.repeat, args.min_time)
+        _join_background_threads()
+        results[name] = {'seconds': seconds, 'threshold': threshold}
+        baseline = baselines.get(name)
+        if baseline is None:
+            print('{:<32} {:>12.4f} {:>12} {:>8}'.format(name, seconds * 1e3, '-', '-'))
+            continue
+        ratio = seconds / baseline['seconds']
+        limit = args.threshold if args.threshold is not None else baseline.get('threshold', threshold)
+        flag = ''
+        if ratio > limit:
+            regressions.append(name)
+            flag = '  REGRESSION (> ' + str(limit) + 'x)'
+        print('{:<32} {:>12.4f} {:>12.4f} {:>8.2f}{}'.format(name, seconds * 1e3, baseline['seconds'] * 1e3,
+                                                            ratio, flag))
+    if args.save:
+        save_baselines(args.baselines, results)
+        print('Baselines saved to ' + args.baselines)
+    elif regressions:
+        print(str(len(regressions)) + ' benchmark(s) regressed: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1168 @@
+# -*- coding: utf-8 -*-
+# In-process stand-in for the parts of the JMad Java API used by pyjmad. install() registers fake jpype and
+# cmmnbuild_dep_manager modules before pyjmad is imported, so the Python wrappers can be benchmarked on a plain
+# machine without a JVM, network or CERN model packs. The lattice is a synthetic ring of FODO cells, see configure().
+# Every call from Python into a stand-in method (and every item pulled from a Java list) pays a fixed bridge cost,
+# like a JPype round trip does, so code that goes back to per-element calls shows up in the timings.
+import array
+import collections
+import collections.abc
+import functools
+import math
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+_config = {'cells': 100, 'call_cost': 2e-6}
+
+
+def configure(cells=100, call_cost=None):
+    _config['cells'] = cells
+    if call_cost is not None:
+        _config['call_cost'] = call_cost
+
+
+# ----------------------------------------------------------------------------
+# java.lang / guava
+
+class Double(float):
+    def doubleValue(self):
+        return float(self)
+
+
+class Integer(int):
+    def intValue(self):
+        return int(self)
+
+
+class String(str):
+    def getClass(self):
+        return String
+
+
+class JavaList(list):
+    def __iter__(self):
+        for item in list.__iter__(self):
+            _bridge_call()
+            yield item
+
+    def size(self):
+        return len(self)
+
+    def get(self, i):
+        return self[i]
+
+    def isEmpty(self):
+        return len(self) == 0
+
+    def contains(self, value):
+        return value in self
+
+
+class ArrayList(JavaList):
+    pass
+
+
+class _DoubleList(JavaList):
+    def __init__(self, values):
+        JavaList.__init__(self)
+        self._values = np.ascontiguousarray(values, dtype=np.float64)
+
+    def __iter__(self):
+        for v in self._values:
+            _bridge_call()
+            yield Double(v)
+
+    def __len__(self):
+        return len(self._values)
+
+    def size(self):
+        return len(self._values)
+
+
+class Doubles(object):
+    @staticmethod
+    def toArray(values):
+        primitive = array.array('d')
+        if isinstance(values, _DoubleList):
+            primitive.frombytes(values._values.tobytes())
+        else:
+            primitive.extend(values)
+        return primitive
+
+
+class Iterables(object):
+    @staticmethod
+    def toArray(values, cls):
+        return list(values)
+
+
+# ----------------------------------------------------------------------------
+# Reactor
+
+class Mono(object):
+    def __init__(self, supplier):
+        self._supplier = supplier
+
+    def block(self):
+        return self._supplier()
+
+    def subscribe(self, consumer, error_consumer=None, complete_consumer=None):
+        def run():
+            try:
+                value = self._supplier()
+            except Exception as e:
+                if error_consumer is not None:
+                    error_consumer.accept(e)
+                return
+            if value is not None:
+                consumer.accept(value)
+            if complete_consumer is not None:
+                complete_consumer.run()
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class Flux(object):
+    def __init__(self, supplier):
+        self._supplier = supplier
+
+    def collectList(self):
+        return Mono(lambda: JavaList(self._supplier()))
+
+
+# ----------------------------------------------------------------------------
+# domain: elements
+
+class _Position(object):
+    def __init__(self, value):
+        self._value = value
+
+    def getValue(self):
+        return self._value
+
+
+class _JavaClass(object):
+    def __init__(self, name):
+        self._name = name
+
+    def getSimpleName(self):
+        return self._name
+
+
+class AbstractElement(object):
+    MADX_TYPE = 'UNKNOWN'
+    TYPED = ()
+
+    def __init__(self, name, position, length, **attributes):
+        self._name = name
+        self._position = position
+        self._length = length
+        self._attributes = {k: 0.0 for k in self.TYPED}
+        self._attributes.update(attributes)
+        self._listeners = []
+
+    def getClass(self):
+        return _JavaClass(type(self).__name__)
+
+    def getName(self):
+        return String(self._name)
+
+    def getMadxElementType(self):
+        return self.MADX_TYPE
+
+    def getLength(self):
+        return self._length
+
+    def setLength(self, length):
+        self._length = length
+
+    def getPosition(self):
+        return _Position(self._position)
+
+    def setPosition(self, position):
+        self._position = position
+
+    def getAttribute(self, name):
+        if name not in self._attributes:
+            return None
+        return Double(self._attributes[name])
+
+    def setAttribute(self, name, value):
+        self._attributes[name] = float(value)
+        for listener in self._listeners:
+            listener(self)
+
+    def getAttributeNames(self):
+        return JavaList(self._attributes.keys())
+
+
+def _element_class(name, madx_type, typed):
+    members = {'MADX_TYPE': madx_type, 'TYPED': tuple(typed)}
+    for attr in typed:
+        java_name = {'hkick': 'HKick', 'vkick': 'VKick'}.get(attr, attr.capitalize())
+        members['get' + java_name] = lambda self, attr=attr: Double(self._attributes[attr])
+        members['set' + java_name] = lambda self, v, attr=attr: self.setAttribute(attr, v)
+    return type(name, (AbstractElement,), members)
+
+
+Quadrupole = _element_class('Quadrupole', 'QUADRUPOLE', ['k1', 'tilt'])
+Bend = _element_class('Bend', 'SBEND', ['angle', 'e1', 'e2', 'k0', 'k1', 'tilt'])
+Corrector = _element_class('Corrector', 'KICKER', ['hkick', 'vkick', 'tilt'])
+Sextupole = _element_class('Sextupole', 'SEXTUPOLE', ['k2', 'tilt'])
+Monitor = _element_class('Monitor', 'MONITOR', [])
+Marker = _element_class('Marker', 'MARKER', [])
+
+
+def _build_lattice(cells):
+    cell_length = 100.0
+    elements = []
+    for c in range(cells):
+        s0 = c * cell_length
+        quad_k1 = 0.0087 if c % 2 == 0 else -0.0087
+        if c == 0:
+            elements.append(Marker('IP1', s0, 0.0))
+        elements.append(Quadrupole('MQ.%d' % c, s0 + 2.0, 3.0, k1=quad_k1))
+        elements.append(Corrector('MCB.%d' % c, s0 + 4.0, 0.5))
+        elements.append(Monitor('BPM.%d' % c, s0 + 5.0, 0.0))
+        elements.append(Sextupole('MS.%d' % c, s0 + 6.0, 0.4, k2=0.01))
+        elements.append(Bend('MB.%d' % c, s0 + 20.0, 14.0, angle=2 * math.pi / (cells * 3)))
+        elements.append(Bend('MB.%d.B' % c, s0 + 40.0, 14.0, angle=2 * math.pi / (cells * 3)))
+        elements.append(Bend('MB.%d.C' % c, s0 + 60.0, 14.0, angle=2 * math.pi / (cells * 3)))
+        elements.append(Marker('M.%d' % c, s0 + 80.0, 0.0))
+    elements.append(Marker('RING$END', cells * cell_length, 0.0))
+    return elements
+
+
+# ----------------------------------------------------------------------------
+# domain: strengths
+
+class SimpleStrength(object):
+    def __init__(self, name, value, description):
+        self._name = name
+        self._value = value
+        self._listeners = []
+
+    def getName(self):
+        return String(self._name)
+
+    def getValue(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = float(value)
+        for listener in list(self._listeners):
+            listener.changedValue(self)
+
+    def addListener(self, listener):
+        self._listeners.append(listener)
+
+    def removeListener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+
+class StrengthVarSet(object):
+    def __init__(self, strengths):
+        self._strengths = collections.OrderedDict((s._name, s) for s in strengths)
+
+    def getStrength(self, name):
+        return self._strengths.get(name)
+
+    def getStrengths(self):
+        return JavaList(self._strengths.values())
+
+    def addAllStrengths(self, strengths):
+        for s in strengths:
+            self._strengths[s._name] = s
+
+
+# ----------------------------------------------------------------------------
+# domain: twiss
+
+class MadxTwissVariable(object):
+    _NAMES = ['NAME', 'KEYWORD', 'S', 'L', 'BETX', 'BETY', 'ALFX', 'ALFY', 'MUX', 'MUY', 'DX', 'DY', 'DPX', 'DPY',
+              'X', 'Y', 'PX', 'PY', 'K1L', 'K2L', 'ANGLE']
+
+    def __init__(self, name):
+        self._name = name
+
+    def getName(self):
+        return self._name
+
+    def __repr__(self):
+        return self._name
+
+    @classmethod
+    def values(cls):
+        return [cls(n) for n in cls._NAMES]
+
+
+class MadxGlobalVariable(MadxTwissVariable):
+    _NAMES = ['Q1', 'Q2', 'DQ1', 'DQ2', 'LENGTH', 'ALFA', 'GAMMATR']
+
+
+class TfsResultRequestImpl(object):
+    def __init__(self):
+        self.variables = []
+        self.filters = []
+
+    @classmethod
+    def createDefaultRequest(cls):
+        return cls()
+
+    def addVariable(self, var):
+        self.variables.append(var)
+
+    def addElementFilter(self, f):
+        self.filters.append(f)
+
+
+class _Summary(object):
+    def __init__(self, values):
+        self._values = values
+
+    def getKeys(self):
+        return JavaList(self._values.keys())
+
+    def getVarType(self, key):
+        return 'STRING' if isinstance(self._values[key], str) else 'DOUBLE'
+
+    def getStringValue(self, key):
+        return self._values[key]
+
+    def getDoubleValue(self, key):
+        return Double(self._values[key])
+
+
+class TfsResult(object):
+    def __init__(self, summary, columns):
+        self._summary = _Summary(summary)
+        self._columns = columns
+
+    def getSummary(self):
+        return self._summary
+
+    def getKeys(self):
+        return JavaList(self._columns.keys())
+
+    def getVarType(self, key):
+        return 'STRING' if self._columns[key].dtype == object else 'DOUBLE'
+
+    def getStringData(self, key):
+        return JavaList(String(s) for s in self._columns[key])
+
+    def getDoubleData(self, key):
+        return _DoubleList(self._columns[key])
+
+
+# ----------------------------------------------------------------------------
+# domain: definitions / ranges / model
+
+class MadxRange(object):
+    def __init__(self, first, last=None):
+        self.first = first
+        self.last = last if last is not None else first
+
+    def getMadxString(self):
+        return self.first if self.first == self.last else self.first + '/' + self.last
+
+    def __repr__(self):
+        return self.getMadxString()
+
+
+class TwissInitialConditionsImpl(object):
+    def __init__(self, name=None):
+        self.values = {}
+
+
+class RangeDefinitionImpl(object):
+    def __init__(self, sequenceDefinition, name, madxRange, twissInitialConditions=None):
+        self._sequence = sequenceDefinition
+        self._name = name
+        self._madxRange = madxRange
+        self._ic = twissInitialConditions
+
+    def getName(self):
+        return self._name
+
+    def getSequenceDefinition(self):
+        return self._sequence
+
+    def getMadxRange(self):
+        return self._madxRange
+
+    def getTwiss(self):
+        return self._ic
+
+    def __str__(self):
+        return self._name
+
+
+class Beam(object):
+    def getBunchCurrent(self):
+        return None
+
+    def getBunchLength(self):
+        return None
+
+    def getBunchNumber(self):
+        return Integer(2808)
+
+    def getBunched(self):
+        return None
+
+    def getCharge(self):
+        return Double(1.0)
+
+    def getDirection(self):
+        return 'PLUS'
+
+    def getEnergy(self):
+        return Double(6500.0)
+
+    def getGamma(self):
+        return None
+
+    def getHorizontalEmittance(self):
+        return None
+
+    def getVerticalEmittance(self):
+        return None
+
+    def getMass(self):
+        return Double(0.938)
+
+    def getMomentum(self):
+        return None
+
+    def getNormalisedHorizontalEmittance(self):
+        return Double(3.5e-6)
+
+    def getNormalisedVerticalEmittance(self):
+        return Double(3.5e-6)
+
+    def getParticle(self):
+        return 'PROTON'
+
+    def getRadiate(self):
+        return None
+
+    def getRelativeEnergySpread(self):
+        return None
+
+
+class SequenceDefinitionImpl(object):
+    def __init__(self, name):
+        self._name = name
+        self._ranges = [RangeDefinitionImpl(self, 'ALL', MadxRange('#s', '#e')),
+                        RangeDefinitionImpl(self, 'ARC12', MadxRange('MQ.1', 'M.2'))]
+        self._beam = Beam()
+
+    def getName(self):
+        return self._name
+
+    def getRangeDefinitions(self):
+        return JavaList(self._ranges)
+
+    def getRangeDefinition(self, name):
+        for r in self._ranges:
+            if r.getName() == name:
+                return r
+        return None
+
+    def getDefaultRangeDefinition(self):
+        return self._ranges[0]
+
+    def getBeam(self):
+        return self._beam
+
+
+class OpticsDefinitionImpl(object):
+    def __init__(self, name):
+        self._name = name
+
+    def getName(self):
+        return self._name
+
+
+class ModelDefinitionImpl(object):
+    def __init__(self, name, optics=('OPTIC_A', 'OPTIC_B'), sequences=('ring',)):
+        self._name = name
+        self._optics = [OpticsDefinitionImpl(o) for o in optics]
+        self._sequences = [SequenceDefinitionImpl(s) for s in sequences]
+
+    def getName(self):
+        return self._name
+
+    def getOpticsDefinitions(self):
+        return JavaList(self._optics)
+
+    def getOpticsDefinition(self, name):
+        for o in self._optics:
+            if o.getName() == name:
+                return o
+        return None
+
+    def getSequenceDefinitions(self):
+        return JavaList(self._sequences)
+
+    def getSequenceDefinition(self, name):
+        for s in self._sequences:
+            if s.getName() == name:
+                return s
+        return None
+
+    def getDefaultOpticsDefinition(self):
+        return self._optics[0]
+
+
+class Range(object):
+    def __init__(self, rangeDefinition, elements):
+        self._definition = rangeDefinition
+        self._all = elements
+        madx = rangeDefinition.getMadxRange()
+        if madx.first == '#s':
+            self._elements = JavaList(elements)
+        else:
+            names = [e._name for e in elements]
+            i0, i1 = names.index(madx.first), names.index(madx.last)
+            self._elements = JavaList(elements[i0:i1 + 1])
+
+    def getName(self):
+        return self._definition.getName()
+
+    def getElements(self):
+        return self._elements
+
+    def getRangeDefinition(self):
+        return self._definition
+
+    def equals(self, other):
+        return self is other
+
+
+class _StrengthListener(object):
+    def __init__(self, model):
+        self._model = model
+
+    def changedValue(self, knob):
+        self._model.notifications += 1
+        self._model._values[knob._name] = knob._value
+
+
+class JMadModelImpl(object):
+    def __init__(self, definition):
+        self._definition = definition
+        self._initialized = False
+        self.strengthListener = _StrengthListener(self)
+        self.notifications = 0
+        self.twiss_calls = 0
+        self.match_calls = 0
+        self.reset()
+
+    def reset(self):
+        cells = _config['cells']
+        self._elements = _build_lattice(cells)
+        strengths = [SimpleStrength('on_x1', 0.0, None), SimpleStrength('dQx.b1', 0.0, None),
+                     SimpleStrength('dQy.b1', 0.0, None), SimpleStrength('KQT4.L3', 0.0, None),
+                     SimpleStrength('KQT4.R3', 0.0, None)]
+        strengths += [SimpleStrength('k.%d' % i, 0.001 * i, None) for i in range(cells * 5)]
+        self._strengths = StrengthVarSet(strengths)
+        self._values = {}
+        for s in strengths:
+            s.addListener(self.strengthListener)
+            self._values[s._name] = s._value
+        self._optic = self._definition.getDefaultOpticsDefinition()
+        self._range = Range(self._definition.getSequenceDefinitions()[0].getDefaultRangeDefinition(),
+                            self._elements)
+
+    def init(self):
+        self._initialized = True
+
+    def isInitialized(self):
+        return self._initialized
+
+    def getModelDefinition(self):
+        return self._definition
+
+    def getActiveOpticsDefinition(self):
+        return self._optic
+
+    def setActiveOpticsDefinition(self, optic):
+        self._optic = optic
+
+    def getActiveRange(self):
+        return self._range
+
+    def setActiveRangeDefinition(self, rangeDefinition):
+        self._range = Range(rangeDefinition, self._elements)
+
+    def getStrengthsAndVars(self):
+        return self._strengths
+
+    # physics ------------------------------------------------------------
+
+    def _value(self, name):
+        return self._values.get(name, 0.0)
+
+    def _compute(self):
+        elements = list(self._range._all)
+        n = len(elements)
+        s = np.array([e._position + e._length / 2 for e in elements])
+        circumference = 100.0 * _config['cells']
+        q1 = 62.31 + self._value('dQx.b1') + 0.5 * (self._value('KQT4.L3') - self._value('KQT4.R3'))
+        q2 = 60.32 + self._value('dQy.b1') + 0.5 * (self._value('KQT4.L3') + self._value('KQT4.R3'))
+        k1 = np.array([e._attributes.get('k1', 0.0) for e in elements])
+        phase = 2 * np.pi * s / circumference
+        betx = 100.0 * (1 + 0.3 * np.sin(phase * q1)) + 1000 * np.abs(k1 - 0.0087 * np.sign(k1)).sum()
+        bety = 100.0 * (1 + 0.3 * np.cos(phase * q2))
+        kicks_h = np.array([e._attributes.get('hkick', 0.0) for e in elements])
+        kicks_v = np.array([e._attributes.get('vkick', 0.0) for e in elements])
+        mux = phase * q1 / (2 * np.pi)
+        muy = phase * q2 / (2 * np.pi)
+
+        def orbit(beta, mu, kicks, q):
+            idx = np.nonzero(kicks)[0]
+            x = np.zeros(n)
+            for j in idx:
+                x += np.sqrt(beta * beta[j]) * kicks[j] * np.cos(
+                    2 * np.pi * np.abs(mu - mu[j]) - np.pi * q) / (2 * np.sin(np.pi * q))
+            return x
+
+        x = orbit(betx, mux, kicks_h, q1) + 1e-6 * self._value('on_x1') * np.cos(phase)
+        y = orbit(bety, muy, kicks_v, q2)
+        columns = collections.OrderedDict()
+        columns['NAME'] = np.array([e._name for e in elements], dtype=object)
+        columns['KEYWORD'] = np.array([e.MADX_TYPE for e in elements], dtype=object)
+        columns['S'] = s
+        columns['L'] = np.array([e._length for e in elements])
+        columns['BETX'] = betx
+        columns['BETY'] = bety
+        columns['ALFX'] = np.gradient(betx) * -0.5
+        columns['ALFY'] = np.gradient(bety) * -0.5
+        columns['MUX'] = mux
+        columns['MUY'] = muy
+        columns['DX'] = 1.0 + 0.1 * np.sin(phase)
+        columns['DY'] = np.zeros(n)
+        columns['DPX'] = 0.01 * np.cos(phase)
+        columns['DPY'] = np.zeros(n)
+        columns['X'] = x
+        columns['Y'] = y
+        columns['PX'] = np.gradient(x)
+        columns['PY'] = np.gradient(y)
+        columns['K1L'] = k1 * columns['L']
+        columns['K2L'] = np.array([e._attributes.get('k2', 0.0) for e in elements]) * columns['L']
+        columns['ANGLE'] = np.array([e._attributes.get('angle', 0.0) for e in elements])
+        in_range = [e._name for e in self._range.getElements()]
+        if len(in_range) != n:
+            i0 = [e._name for e in elements].index(in_range[0])
+            columns = collections.OrderedDict((k, v[i0:i0 + len(in_range)]) for k, v in columns.items())
+        summary = collections.OrderedDict([('TITLE', 'standin'), ('Q1', q1), ('Q2', q2),
+                                           ('DQ1', 2.0 + self._value('dQx.b1')), ('DQ2', 2.0),
+                                           ('LENGTH', circumference)])
+        return summary, columns
+
+    def twiss(self, request):
+        self.twiss_calls += 1
+        summary, columns = self._compute()
+        wanted = ['NAME'] + [v.getName() for v in request.variables if v.getName() != 'NAME']
+        return TfsResult(summary, collections.OrderedDict((k, columns[k]) for k in wanted))
+
+    def match(self, request):
+        self.match_calls += 1
+        varies = request.varies
+        names = [v._parameter._name for v in varies]
+
+        def residuals():
+            summary, columns = self._compute()
+            res = []
+            for c in request.constraints:
+                for k, v in c.values.items():
+                    if isinstance(c, MatchConstraintGlobal):
+                        res.append(summary[k] - v)
+                    else:
+                        idx = list(columns['NAME']).index(c._range.first)
+                        res.append(columns[k][idx] - v)
+            return np.array(res)
+
+        for _ in range(5):
+            r0 = residuals()
+            x0 = np.array([self._value(n) for n in names])
+            jac = np.zeros((len(r0), len(names)))
+            for j, n in enumerate(names):
+                self._values[n] = x0[j] + 1e-6
+                jac[:, j] = (residuals() - r0) / 1e-6
+                self._values[n] = x0[j]
+            dx = np.linalg.lstsq(jac, -r0, rcond=None)[0]
+            for j, n in enumerate(names):
+                self._values[n] = x0[j] + dx[j]
+                strength = self._strengths.getStrength(n)
+                if strength is not None:
+                    strength._value = self._values[n]
+        r = residuals()
+        return MatchResult(float((r ** 2).sum()),
+                           [(n, self._value(n)) for n in names],
+                           [(c, float(v)) for c, v in zip(request.constraints, r)])
+
+
+class MatchResultRequestImpl(object):
+    def __init__(self):
+        self.constraints = []
+        self.varies = []
+
+    def addMatchConstraint(self, c):
+        self.constraints.append(c)
+
+    def addMadxVaryParameter(self, v):
+        self.varies.append(v)
+
+
+def _setters(cls, names, target='values'):
+    for n in names:
+        setattr(cls, 'set' + n.capitalize(),
+                lambda self, v, n=n: getattr(self, target).__setitem__(n, float(v)))
+    return cls
+
+
+class _Constraint(object):
+    def __init__(self):
+        self.values = {}
+
+    def __str__(self):
+        return type(self).__name__ + '{' + ','.join(self.values.keys()) + '}'
+
+
+class MatchConstraintGlobal(_Constraint):
+    pass
+
+
+class MatchConstraintLocal(_Constraint):
+    def __init__(self, madxRange):
+        _Constraint.__init__(self)
+        self._range = madxRange
+
+
+_setters(MatchConstraintGlobal, ['Q1', 'Q2', 'DQ1', 'DQ2'])
+_LOCAL = ['ALFX', 'ALFY', 'BETX', 'BETY', 'DDPX', 'DDPY', 'DDX', 'DDY', 'DPX', 'DPY', 'DX', 'DY', 'MUX', 'MUY',
+          'PX', 'PY', 'X', 'Y']
+_setters(MatchConstraintLocal, _LOCAL)
+_setters(TwissInitialConditionsImpl, _LOCAL)
+TwissInitialConditionsImpl.setClosedOrbit = lambda self, v: self.values.__setitem__('closed_orbit', v)
+
+
+class MadxParameterImpl(object):
+    def __init__(self, name):
+        self._name = name
+
+
+class MadxVaryParameterImpl(object):
+    def __init__(self, parameter):
+        self._parameter = parameter
+
+    def setLower(self, v):
+        self.lower = v
+
+    def setUpper(self, v):
+        self.upper = v
+
+    def setStep(self, v):
+        self.step = v
+
+
+class _ParameterResult(object):
+    def __init__(self, name, value):
+        self._name = name
+        self._value = value
+
+    def getName(self):
+        return self._name
+
+    def getFinalValue(self):
+        return self._value
+
+    def getConstraint(self):
+        return self._name
+
+
+class MatchResult(object):
+    def __init__(self, penalty, varies, constraints):
+        self._penalty = penalty
+        self._varies = varies
+        self._constraints = constraints
+
+    def getFinalPenalty(self):
+        return self._penalty
+
+    def getVaryParameterResults(self):
+        return JavaList(_ParameterResult(n, v) for n, v in self._varies)
+
+    def getConstraintParameterResults(self):
+        return JavaList(_ParameterResult(c, v) for c, v in self._constraints)
+
+
+# ----------------------------------------------------------------------------
+# services
+
+class _ModelDefinitionManager(object):
+    def __init__(self, definitions):
+        self._definitions = definitions
+
+    def getAllModelDefinitions(self):
+        return JavaList(self._definitions)
+
+
+class _ModelManager(object):
+    pass
+
+
+class JMadService(object):
+    def __init__(self):
+        self._definitions = [ModelDefinitionImpl('STANDIN RING'), ModelDefinitionImpl('STANDIN LINE')]
+
+    def getModelDefinitionManager(self):
+        return _ModelDefinitionManager(self._definitions)
+
+    def getModelManager(self):
+        return _ModelManager()
+
+    def createModel(self, definition):
+        return JMadModelImpl(definition)
+
+
+class JMadServiceFactory(object):
+    @staticmethod
+    def createJMadService():
+        return JMadService()
+
+
+class _Connector(object):
+    def __init__(self, name):
+        self._name = name
+
+    def __str__(self):
+        return self._name
+
+
+class JMadModelPackageRepository(object):
+    def __init__(self, baseUrl, repoName, connectorId):
+        self._baseUrl = baseUrl
+        self._repoName = repoName
+        self._connectorId = connectorId
+
+    def connectorId(self):
+        return _Connector(self._connectorId)
+
+    def baseUrl(self):
+        return self._baseUrl
+
+    def repoName(self):
+        return self._repoName
+
+    def __eq__(self, other):
+        return (self._baseUrl, self._repoName) == (other._baseUrl, other._repoName)
+
+    def __hash__(self):
+        return hash((self._baseUrl, self._repoName))
+
+
+class InternalRepository(JMadModelPackageRepository):
+    pass
+
+
+InternalRepository.INTERNAL = InternalRepository('jmad', 'internal', 'internal-classpath')
+
+
+class InternalPackageVariant(object):
+    pass
+
+
+class _Variant(object):
+    def __init__(self, kind, name):
+        self._kind = kind
+        self._name = name
+
+    def type(self):
+        return self._kind
+
+    def name(self):
+        return self._name
+
+
+class _ModelPackage(object):
+    def __init__(self, name, repository):
+        self._name = name
+        self._repository = repository
+
+    def name(self):
+        return self._name
+
+    def repository(self):
+        return self._repository
+
+
+class ModelPackageVariant(object):
+    def __init__(self, package, variant, definitions):
+        self._package = package
+        self._variant = variant
+        self._definitions = definitions
+
+    def modelPackage(self):
+        return self._package
+
+    def variant(self):
+        return self._variant
+
+    def fullName(self):
+        return self._package.name() + '-' + self._variant.name()
+
+
+class PackageRepositoryManager(object):
+    def __init__(self):
+        self._enabled = [JMadModelPackageRepository('https://gitlab.example', 'standin-packs',
+                                                    'gitlab-group-api-v4')]
+
+    def enabledRepositories(self):
+        return Flux(lambda: list(self._enabled))
+
+    def enable(self, repo):
+        if repo not in self._enabled:
+            self._enabled.append(repo)
+
+    def disable(self, repo):
+        if repo in self._enabled:
+            self._enabled.remove(repo)
+
+
+class JMadModelPackageService(object):
+    available_calls = 0
+
+    def __init__(self, repositoryManager):
+        self._repositoryManager = repositoryManager
+
+    def availablePackages(self):
+        def packages():
+            JMadModelPackageService.available_calls += 1
+            result = []
+            for repo in self._repositoryManager._enabled:
+                for pkg in ('standin-ring', 'standin-line'):
+                    package = _ModelPackage(pkg + '-' + repo._repoName, repo)
+                    for kind, variant in (('BRANCH', 'master'), ('TAG', 'v1.0')):
+                        result.append(ModelPackageVariant(package, _Variant(kind, variant),
+                                                          [ModelDefinitionImpl('STANDIN RING')]))
+            return result
+
+        return Flux(packages)
+
+    def modelDefinitionsFrom(self, variant):
+        return Flux(lambda: list(variant._definitions))
+
+    def clearCache(self):
+        return Mono(lambda: None)
+
+
+class _ApplicationContext(object):
+    def __init__(self, configuration):
+        if configuration is JMadGuiStandaloneConfiguration:
+            raise RuntimeError('no display')
+        repositories = PackageRepositoryManager()
+        self._beans = {'jmadService': JMadService(),
+                       'packageRepositoryManager': repositories,
+                       'jmadModelPackageService': JMadModelPackageService(repositories)}
+
+    def getBean(self, name):
+        return self._beans[name]
+
+    def getBeanDefinitionNames(self):
+        return list(self._beans.keys())
+
+    def toString(self):
+        return 'StandinApplicationContext'
+
+
+def AnnotationConfigApplicationContext(configurations):
+    return _ApplicationContext(configurations[0])
+
+
+ClassPathXmlApplicationContext = AnnotationConfigApplicationContext
+
+
+class JMadGuiStandaloneConfiguration(object):
+    pass
+
+
+class JMadModelPackageServiceStandaloneConfiguration(object):
+    pass
+
+
+class _Level(object):
+    WARN = 'WARN'
+
+    @staticmethod
+    def toLevel(level):
+        return level
+
+
+class _Logger(object):
+    @staticmethod
+    def getRootLogger():
+        return _Logger()
+
+    def setLevel(self, level):
+        pass
+
+
+class _BasicConfigurator(object):
+    @staticmethod
+    def configure():
+        pass
+
+
+# ----------------------------------------------------------------------------
+# jpype
+
+_CLASSES = {
+    'java.lang.Double': Double,
+    'java.lang.String': String,
+    'java.lang.Integer': Integer,
+    'java.util.ArrayList': ArrayList,
+    'com.google.common.primitives.Doubles': Doubles,
+    'com.google.common.collect.Iterables': Iterables,
+    'org.apache.log4j.BasicConfigurator': _BasicConfigurator,
+    'org.apache.log4j.Logger': _Logger,
+    'org.apache.log4j.Level': _Level,
+    'org.springframework.context.annotation.AnnotationConfigApplicationContext': AnnotationConfigApplicationContext,
+    'org.springframework.context.support.ClassPathXmlApplicationContext': ClassPathXmlApplicationContext,
+    'org.jmad.modelpack.service.conf.JMadModelPackageServiceStandaloneConfiguration':
+        JMadModelPackageServiceStandaloneConfiguration,
+    'org.jmad.modelpack.domain.JMadModelPackageRepository': JMadModelPackageRepository,
+    'org.jmad.modelpack.connect.embedded.domain.InternalRepository': InternalRepository,
+    'org.jmad.modelpack.connect.embedded.domain.InternalPackageVariant': InternalPackageVariant,
+    'cern.accsoft.steering.jmad.service.JMadServiceFactory': JMadServiceFactory,
+    'cern.accsoft.steering.jmad.gui.JMad': object,
+    'cern.accsoft.steering.jmad.gui.manage.impl.JMadGuiPreferencesImpl': object,
+    'cern.accsoft.steering.jmad.gui.config.JMadGuiStandaloneConfiguration': JMadGuiStandaloneConfiguration,
+    'cern.accsoft.steering.jmad.domain.result.tfs.TfsResultRequestImpl': TfsResultRequestImpl,
+    'cern.accsoft.steering.jmad.domain.var.enums.MadxTwissVariable': MadxTwissVariable,
+    'cern.accsoft.steering.jmad.domain.var.enums.MadxGlobalVariable': MadxGlobalVariable,
+    'cern.accsoft.steering.jmad.domain.machine.Range': Range,
+    'cern.accsoft.steering.jmad.domain.machine.MadxRange': MadxRange,
+    'cern.accsoft.steering.jmad.domain.machine.RangeDefinitionImpl': RangeDefinitionImpl,
+    'cern.accsoft.steering.jmad.domain.twiss.TwissInitialConditionsImpl': TwissInitialConditionsImpl,
+    'cern.accsoft.steering.jmad.domain.knob.strength.SimpleStrength': SimpleStrength,
+    'cern.accsoft.steering.jmad.domain.knob.MadxParameterImpl': MadxParameterImpl,
+    'cern.accsoft.steering.jmad.domain.result.match.MatchResultRequestImpl': MatchResultRequestImpl,
+    'cern.accsoft.steering.jmad.domain.result.match.input.MadxVaryParameterImpl': MadxVaryParameterImpl,
+    'cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintGlobal': MatchConstraintGlobal,
+    'cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintLocal': MatchConstraintLocal,
+}
+
+
+_bridge = threading.local()
+
+
+def _bridge_call():
+    if getattr(_bridge, 'depth', 0) == 0:
+        end = time.perf_counter() + _config['call_cost']
+        while time.perf_counter() < end:
+            pass
+
+
+def _bridged(fn):
+    # only the outermost call crosses the bridge - stand-in methods calling each other stay on the "Java" side
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        _bridge_call()
+        _bridge.depth = getattr(_bridge, 'depth', 0) + 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _bridge.depth -= 1
+
+    call._bridged = True
+    return call
+
+
+def _charge_bridge_calls():
+    for cls in list(globals().values()):
+        if not isinstance(cls, type) or cls.__module__ != __name__ or cls in (JPackage, JProxy):
+            continue
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_'):
+                continue
+            if isinstance(member, (staticmethod, classmethod)):
+                if not getattr(member.__func__, '_bridged', False):
+                    setattr(cls, name, type(member)(_bridged(member.__func__)))
+            elif callable(member) and not isinstance(member, type) and not getattr(member, '_bridged', False):
+                setattr(cls, name, _bridged(member))
+
+
+class JPackage(object):
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        full = self._name + '.' + name
+        if full in _CLASSES:
+            return _CLASSES[full]
+        return JPackage(full)
+
+
+class JProxy(object):
+    def __init__(self, interface, dict=None, inst=None):
+        for k, v in (dict or {}).items():
+            setattr(self, k, v)
+
+
+_jvm = {'started': False, 'options': ()}
+
+
+def _make_jpype():
+    mod = types.ModuleType('jpype')
+    mod.JPackage = JPackage
+    mod.JProxy = JProxy
+    mod.JClass = lambda name: _CLASSES[name]
+    mod.isJVMStarted = lambda: _jvm['started']
+
+    def startJVM(*args, **kwargs):
+        _jvm['started'] = True
+        _jvm['options'] = args
+
+    mod.startJVM = startJVM
+    mod.getDefaultJVMPath = lambda: '/standin/libjvm.so'
+    mod.isThreadAttachedToJVM = lambda: True
+    mod.attachThreadToJVM = lambda: None
+    mod.setupGuiEnvironment = lambda f: f()
+    return mod
+
+
+def _make_dep_manager(jpype):
+    mod = types.ModuleType('cmmnbuild_dep_manager')
+
+    class Manager(object):
+        def __init__(self, name=None):
+            self.name = name
+
+        def class_path(self):
+            return '/standin/classes'
+
+        def start_jpype_jvm(self):
+            if not jpype.isJVMStarted():
+                jpype.startJVM(jpype.getDefaultJVMPath(), '-Djava.class.path=' + self.class_path())
+            return jpype
+
+    mod.Manager = Manager
+    return mod
+
+
+def install():
+    _charge_bridge_calls()
+    jpype = _make_jpype()
+    sys.modules['jpype'] = jpype
+    sys.modules['cmmnbuild_dep_manager'] = _make_dep_manager(jpype)
+    return jpype
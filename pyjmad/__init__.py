@@ -33,6 +33,8 @@ __gradle_deps__ = [
 try:
     from .pyjmad import *
     from . import element, matching
+    from .pool import ModelPool
+    from .instrument import stats, profile
 except:
     import logging
 
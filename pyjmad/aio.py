@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .pyjmad import start_jvm, _attach_thread_to_jvm
+
+_shared = {'executor': None}
+_shared_lock = threading.Lock()
+# JProxy objects must stay referenced until Reactor has called them
+_subscriptions = set()
+
+
+def shared_executor():
+    with _shared_lock:
+        if _shared['executor'] is None:
+            _shared['executor'] = ThreadPoolExecutor(max_workers=4)
+        return _shared['executor']
+
+
+def model_executor():
+    # one thread per model, as a model's MAD-X state must not be used concurrently
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def _call_attached(fn, *args, **kwargs):
+    _attach_thread_to_jvm()
+    return fn(*args, **kwargs)
+
+
+def run_in_executor(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, functools.partial(_call_attached, fn, *args, **kwargs))
+
+
+def mono_to_future(mono, loop=None):
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(value):
+        if not future.done():
+            future.set_result(value)
+
+    def set_exception(error):
+        if not future.done():
+            if not isinstance(error, BaseException):
+                error = RuntimeError(str(error))
+            future.set_exception(error)
+
+    jpype = start_jvm()
+    on_next = jpype.JProxy('java.util.function.Consumer',
+                           dict={'accept': lambda value: loop.call_soon_threadsafe(set_result, value)})
+    on_error = jpype.JProxy('java.util.function.Consumer',
+                            dict={'accept': lambda error: loop.call_soon_threadsafe(set_exception, error)})
+    on_complete = jpype.JProxy('java.lang.Runnable',
+                               dict={'run': lambda: loop.call_soon_threadsafe(set_result, None)})
+    subscription = (on_next, on_error, on_complete)
+    _subscriptions.add(subscription)
+    future.add_done_callback(lambda f: _subscriptions.discard(subscription))
+    mono.subscribe(on_next, on_error, on_complete)
+    return future
+
+
+def flux_to_future(flux, loop=None):
+    return mono_to_future(flux.collectList(), loop)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import sys
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'entries', 'bytes', 'max_bytes'])
+
+
+def _column_size(col):
+    col = np.asarray(col)
+    if col.dtype == object:
+        # the array only holds pointers - count the strings they point to
+        return col.nbytes + sum(sys.getsizeof(v) for v in col)
+    return col.nbytes
+
+
+def _result_size(result):
+    data = result.data
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(index=True, deep=True).sum())
+    elif isinstance(data, np.ndarray):
+        return data.nbytes
+    elif isinstance(data, dict):
+        return sum(_column_size(col) for col in data.values())
+    else:
+        return 0
+
+
+def _copy_result(result):
+    # callers may modify their result in place - never hand out the cached one
+    data = result.data
+    if isinstance(data, (pd.DataFrame, np.ndarray)):
+        data = data.copy()
+    elif isinstance(data, dict):
+        data = data.__class__((k, np.array(col, copy=True)) for k, col in data.items())
+    return result._replace(summary=dict(result.summary), data=data)
+
+
+class TwissCache(object):
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return _copy_result(entry[0])
+
+    def find(self, match):
+        for key in reversed(self._entries):
+            if match(key):
+                return _copy_result(self._entries[key][0])
+        return None
+
+    def put(self, key, result):
+        size = _result_size(result)
+        if size > self._max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (_copy_result(result), size)
+        self._bytes += size
+        self._trim()
+
+    def _trim(self):
+        while self._bytes > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._trim()
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def reset_stats(self):
+        self._hits = self._misses = self._evictions = 0
+
+    @property
+    def stats(self):
+        return CacheStats(hits=self._hits, misses=self._misses, evictions=self._evictions,
+                          entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'TwissCache(' + ', '.join(k + '=' + str(v) for k, v in self.stats._asdict().items()) + ')'
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .element import _attribute_getter, _attribute_setter, _element_class
+
+
+class Checkpoint(namedtuple('Checkpoint', ['sequence', 'range', 'optic', 'strength_names', 'strength_values',
+                                           'attribute_elements', 'attribute_names', 'attribute_values'])):
+    __slots__ = ()
+
+    def strengths(self):
+        return pd.Series(self.strength_values, index=self.strength_names, name='strength')
+
+    def attributes(self):
+        return pd.Series(self.attribute_values,
+                         index=pd.MultiIndex.from_arrays([self.attribute_elements, self.attribute_names],
+                                                         names=['element', 'attribute']),
+                         name='attribute')
+
+    def diff(self, other):
+        rows = []
+        for kind in ('sequence', 'range', 'optic'):
+            if getattr(self, kind) != getattr(other, kind):
+                rows.append((kind, getattr(self, kind), '', getattr(self, kind), getattr(other, kind)))
+        for kind, mine, theirs in (('strength', self.strengths(), other.strengths()),
+                                   ('attribute', self.attributes(), other.attributes())):
+            both = pd.concat([mine.rename('self'), theirs.rename('other')], axis=1)
+            same = (both['self'] == both['other']) | (both['self'].isnull() & both['other'].isnull())
+            for key, row in both[~same].iterrows():
+                name, attribute = key if kind == 'attribute' else (key, '')
+                rows.append((kind, name, attribute, row['self'], row['other']))
+        return pd.DataFrame(rows, columns=['kind', 'name', 'attribute', 'self', 'other']) \
+            .set_index(['kind', 'name', 'attribute'])
+
+    def __repr__(self):
+        return 'Checkpoint(' + str(self.sequence) + ' - ' + str(self.range) + ' - ' + str(self.optic) + ': ' + \
+               str(len(self.strength_names)) + ' strengths, ' + str(len(self.attribute_names)) + ' attributes)'
+
+
+def _name(value):
+    return None if value is None else str(value)
+
+
+def modified_attributes(model):
+    # only attributes differing from their original value are returned - a missing one means "unmodified"
+    modified = []
+    for (element, attribute), (jmadElement, original) in sorted(model._state.modified_attributes.items(),
+                                                                key=lambda m: m[0]):
+        value = _attribute_getter(_element_class(jmadElement), attribute)(jmadElement)
+        if value != original:
+            modified.append((element, attribute, value))
+    return modified
+
+
+def checkpoint(model):
+    sequence = model.sequence
+    names, values = model.strengths._bulk_values()
+    modified = modified_attributes(model)
+    elements = np.array([m[0] for m in modified], dtype=object)
+    attributes = np.array([m[1] for m in modified], dtype=object)
+    attribute_values = np.array([m[2] for m in modified], dtype=float)
+    return Checkpoint(sequence=None if sequence is None else str(sequence.name), range=_name(model.range),
+                      optic=_name(model.optic),
+                      strength_names=names, strength_values=values, attribute_elements=elements,
+                      attribute_names=attributes, attribute_values=attribute_values)
+
+
+def _restore_strengths(model, checkpoint):
+    names, values = model.strengths._bulk_values()
+    positions = pd.Index(names).get_indexer(checkpoint.strength_names)
+    changed = (positions < 0) | (values[np.maximum(positions, 0)] != checkpoint.strength_values)
+    if changed.any():
+        model.strengths.set_array(list(checkpoint.strength_names[changed]), checkpoint.strength_values[changed])
+    return int(changed.sum())
+
+
+def restore_attributes(model, attributes):
+    state = model._state
+    # attributes modified but not listed go back to their original values
+    targets = {key: original for key, (_, original) in state.modified_attributes.items()}
+    targets.update(((element, attribute), value) for element, attribute, value in attributes)
+    table = None
+    written = 0
+    try:
+        for (element, attribute), value in targets.items():
+            if np.isnan(value):
+                continue
+            tracked = state.modified_attributes.get((element, attribute))
+            if tracked is not None:
+                jmadElements = [tracked[0]]
+            else:
+                if table is None:
+                    table = model.elements._table
+                jmadElements = [table.jmad_elements[i] for i in table.name_index.get(element, [])]
+            for jmadElement in jmadElements:
+                element_class = _element_class(jmadElement)
+                current = _attribute_getter(element_class, attribute)(jmadElement)
+                if current != value:
+                    _attribute_setter(element_class, attribute)(jmadElement, value)
+                    written += 1
+    finally:
+        if written:
+            state.touch()
+    return written
+
+
+def restore(model, checkpoint):
+    sequence = model.sequence
+    if checkpoint.sequence is not None and (sequence is None or str(sequence.name) != checkpoint.sequence):
+        model.sequence = checkpoint.sequence
+    if checkpoint.range is not None and _name(model.range) != checkpoint.range:
+        model.range = checkpoint.range
+    if checkpoint.optic is not None and _name(model.optic) != checkpoint.optic:
+        model.optic = checkpoint.optic
+    attributes = zip(checkpoint.attribute_elements, checkpoint.attribute_names, checkpoint.attribute_values)
+    return _restore_strengths(model, checkpoint) + restore_attributes(model, attributes)
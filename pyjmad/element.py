@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
-from collections import MutableMapping
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
 
 from .pyjmad import cern, java
+from .util import _ModelState
 
 
 class Element(object):
-    def __init__(self, jmadElement):
+    _typed_attributes = ()
+
+    def __init__(self, jmadElement, state=None):
         self._jmadElement = jmadElement
+        self._state = state if state is not None else _ModelState()
 
     @property
     def name(self):
@@ -23,6 +31,8 @@ class Element(object):
     @length.setter
     def length(self, len):
         self._jmadElement.setLength(float(len))
+        self._state.element_table = None
+        self._state.touch()
 
     @property
     def position(self):
@@ -31,10 +41,12 @@ class Element(object):
     @position.setter
     def position(self, position):
         self._jmadElement.setPosition(float(position))
+        self._state.element_table = None
+        self._state.touch()
 
     @property
     def attributes(self):
-        return Attributes(self._jmadElement)
+        return Attributes(self._jmadElement, self._state)
 
     def __str__(self):
         return self.name + ' (' + self.type + ')'
@@ -43,14 +55,23 @@ class Element(object):
         return self.name + ' (' + self.type + ': ' + str(self.attributes) + ')'
 
 
+def _java_name(attribute):
+    return ''.join([s.capitalize() for s in attribute.split('_')])
+
+
 def _specific_element(name, attributes):
+    def setter(self, v, attribute, java_name):
+        _track_attribute(self._state, self._jmadElement, attribute)
+        self._jmadElement.__getattribute__('set' + java_name)(float(v))
+        self._state.touch()
+
     attr_dict = {}
     for attr in attributes:
-        java_name = ''.join([s.capitalize() for s in attr.split('_')])
+        java_name = _java_name(attr)
         p = property(lambda self, java_name=java_name: self._jmadElement.__getattribute__('get' + java_name)()) \
-            .setter(
-            lambda self, v, java_name=java_name: self._jmadElement.__getattribute__('set' + java_name)(float(v)))
+            .setter(lambda self, v, attr=attr, java_name=java_name: setter(self, v, attr, java_name))
         attr_dict[attr] = p
+    attr_dict['_typed_attributes'] = tuple(attributes)
     return type(name, (Element,), attr_dict)
 
 
@@ -68,30 +89,311 @@ Octupole = _specific_element('Octupole', ['k3', 'tilt'])
 Solenoid = _specific_element('Solenoid', ['ks', 'ksi'])
 
 
-def from_jmad(jmadElement):
-    _jmadElementMap = {
-        'BeamBeam': BeamBeam,
-        'Bend': Bend,
-        'Corrector': Corrector,
-        'Marker': Marker,
-        'Monitor': Monitor,
-        'Octupole': Octupole,
-        'Quadrupole': Quadrupole,
-        'Sextupole': Sextupole,
-        'Solenoid': Solenoid,
-        'UnknownElement': Element
-    }
-    return _jmadElementMap[jmadElement.getClass().getSimpleName()](jmadElement)
+_ELEMENT_CLASSES = OrderedDict([
+    ('UnknownElement', Element),
+    ('BeamBeam', BeamBeam),
+    ('Bend', Bend),
+    ('Corrector', Corrector),
+    ('Marker', Marker),
+    ('Monitor', Monitor),
+    ('Octupole', Octupole),
+    ('Quadrupole', Quadrupole),
+    ('Sextupole', Sextupole),
+    ('Solenoid', Solenoid),
+])
+ELEMENT_TYPES = tuple(_ELEMENT_CLASSES.keys())
+_ELEMENT_TYPE_CODES = {t: code for code, t in enumerate(ELEMENT_TYPES)}
+
+
+def from_jmad(jmadElement, state=None):
+    return _ELEMENT_CLASSES[jmadElement.getClass().getSimpleName()](jmadElement, state)
+
+
+def _element_class(jmadElement):
+    return _ELEMENT_CLASSES.get(str(jmadElement.getClass().getSimpleName()), Element)
+
+
+def _track_attribute(state, jmadElement, attribute, original=None):
+    key = (str(jmadElement.getName()), attribute)
+    if key not in state.modified_attributes:
+        if original is None:
+            original = _attribute_getter(_element_class(jmadElement), attribute)(jmadElement)
+        state.modified_attributes[key] = (jmadElement, original)
+
+
+def _is_whole_ring(jmadRange):
+    madxRange = jmadRange.getRangeDefinition().getMadxRange()
+    return str(madxRange.getMadxString()).lower() == '#s/#e'
+
+
+class _ElementTable(object):
+    def __init__(self, jmadElements, state, jmadRange=None, wrappers=None):
+        self.jmad_range = jmadRange
+        self.jmad_elements = list(jmadElements)
+        self._state = state
+        n = len(self.jmad_elements)
+        self.names = np.empty(n, dtype=object)
+        self.type_codes = np.empty(n, dtype=np.int8)
+        self.madx_types = np.empty(n, dtype=object)
+        self.positions = np.empty(n)
+        self.lengths = np.empty(n)
+        for i, jmadElement in enumerate(self.jmad_elements):
+            self.names[i] = str(jmadElement.getName())
+            self.type_codes[i] = _ELEMENT_TYPE_CODES.get(str(jmadElement.getClass().getSimpleName()), 0)
+            self.madx_types[i] = str(jmadElement.getMadxElementType())
+            self.positions[i] = jmadElement.getPosition().getValue()
+            self.lengths[i] = jmadElement.getLength()
+        self.name_index = {}
+        for i, name in enumerate(self.names):
+            self.name_index.setdefault(name, []).append(i)
+        self._wrappers = {} if wrappers is None else dict(enumerate(wrappers))
+        self._attribute_arrays = {}
+        self._position_index = None
+
+    @classmethod
+    def from_range(cls, jmadRange, state):
+        return cls(jmadRange.getElements(), state, jmadRange=jmadRange)
+
+    @classmethod
+    def from_elements(cls, elements, state):
+        return cls([e._jmadElement for e in elements], state, wrappers=elements)
+
+    def element(self, i):
+        wrapper = self._wrappers.get(i)
+        if wrapper is None:
+            element_class = _ELEMENT_CLASSES[ELEMENT_TYPES[self.type_codes[i]]]
+            wrapper = element_class(self.jmad_elements[i], self._state)
+            self._wrappers[i] = wrapper
+        return wrapper
+
+    def attribute_column(self, attribute, indices):
+        values = np.full(len(indices), np.nan)
+        codes = self.type_codes[indices]
+        for code in np.unique(codes):
+            getter = _attribute_getter(_ELEMENT_CLASSES[ELEMENT_TYPES[code]], attribute)
+            for p in np.nonzero(codes == code)[0]:
+                values[p] = getter(self.jmad_elements[indices[p]])
+        if len(values) and np.isnan(values).all() and \
+                not any(attribute in c._typed_attributes for c in _ELEMENT_CLASSES.values()):
+            # most likely a typo - an attribute no element class knows and none of the elements has
+            raise ValueError('Attribute ' + attribute + ' not available for any of the elements')
+        return values
+
+    def attribute_array(self, attribute, codes, indices):
+        # values are read once per element and kept until the model state changes (any element or strength write)
+        key = (attribute, codes)
+        cached = self._attribute_arrays.get(key)
+        if cached is None or cached[0] != self._state.version:
+            cached = (self._state.version, np.full(len(self), np.nan), np.zeros(len(self), dtype=bool))
+            self._attribute_arrays[key] = cached
+        _, values, known = cached
+        missing = indices[~known[indices]]
+        if len(missing):
+            values[missing] = self.attribute_column(attribute, missing)
+            known[missing] = True
+        return values[indices]
+
+    @property
+    def circumference(self):
+        # positions only wrap around on a range covering the whole ring - 0 means no wrapping
+        if self.jmad_range is None or not len(self) or not _is_whole_ring(self.jmad_range):
+            return 0.0
+        # the sequence may end with a drift - its end marker sits at the sequence length
+        if self.names[-1].upper().endswith('$END'):
+            return float(self.positions[-1])
+        return float(np.max(self.positions + self.lengths / 2))
+
+    def position_index(self, indices=None):
+        if indices is not None:
+            return _PositionIndex(self.positions[indices], self.lengths[indices], self.circumference)
+        if self._position_index is None:
+            self._position_index = _PositionIndex(self.positions, self.lengths, self.circumference)
+        return self._position_index
+
+    def set_attribute_column(self, attribute, indices, values):
+        codes = self.type_codes[indices]
+        type_codes = tuple(int(c) for c in np.unique(codes))
+        setters = {}
+        invalid = []
+        for code in type_codes:
+            element_class = _ELEMENT_CLASSES[ELEMENT_TYPES[code]]
+            if attribute not in element_class._typed_attributes:
+                example = self.jmad_elements[indices[np.argmax(codes == code)]]
+                if attribute not in [str(n) for n in example.getAttributeNames()]:
+                    invalid.append(ELEMENT_TYPES[code])
+            setters[code] = _attribute_setter(element_class, attribute)
+        if invalid:
+            raise ValueError('Attribute ' + attribute + ' not available for element type(s) ' + ', '.join(invalid))
+        previous = self.attribute_array(attribute, type_codes, indices)
+        # NaN is never written - it stands for a value that could not be read (e.g. the previous value in an undo)
+        changed = np.nonzero((values != previous) & ~np.isnan(values))[0]
+        if not len(changed):
+            return previous
+        modified = self._state.modified_attributes
+        writes = list(zip(self.names[indices[changed]], codes[changed].tolist(),
+                          [self.jmad_elements[i] for i in indices[changed]],
+                          values[changed].tolist(), previous[changed].tolist()))
+        applied = []
+        try:
+            for _, code, jmadElement, value, original in writes:
+                setters[code](jmadElement, value)
+                applied.append((code, jmadElement, original))
+        except Exception:
+            logging.warning('Failed to set ' + attribute + ', rolling back ' + str(len(applied)) + ' changes')
+            for code, jmadElement, original in reversed(applied):
+                if not np.isnan(original):
+                    setters[code](jmadElement, original)
+            raise
+        finally:
+            self._state.touch()
+        # the originals are only recorded once all writes went through - a rolled back call leaves no trace
+        for name, _, jmadElement, _, original in writes:
+            if (name, attribute) not in modified and not np.isnan(original):
+                modified[(name, attribute)] = (jmadElement, original)
+        return previous
+
+    def __len__(self):
+        return len(self.jmad_elements)
+
+
+class _PositionIndex(object):
+    # elements extend by half their length around their position (MAD-X refer=centre)
+    def __init__(self, positions, lengths, circumference):
+        starts = positions - lengths / 2
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = (positions + lengths / 2)[self.order]
+        self.circumference = circumference
+        self.max_length = float(np.max(lengths)) if len(lengths) else 0.0
+        # for each sorted element, the element reaching furthest among all starting at or before it
+        furthest = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+        self.reach = np.maximum.accumulate(np.where(self.ends == furthest, np.arange(len(self.ends)), 0))
+
+    def _wrap(self, s):
+        if self.circumference > 0:
+            return np.mod(s, self.circumference)
+        return s
+
+    def lookup(self, s):
+        s = self._wrap(np.asarray(s, dtype=float))
+        found = np.full(s.shape, -1, dtype=int)
+        if not len(self.starts):
+            return found
+        last = np.searchsorted(self.starts, s, side='right') - 1
+        valid = last >= 0
+        last = np.maximum(last, 0)
+        # the last element starting at or before s is the most specific one (e.g. a marker inside a quadrupole)
+        hit = valid & (self.ends[last] >= s)
+        furthest = self.reach[last]
+        inside = valid & ~hit & (self.ends[furthest] > s)
+        found[hit] = self.order[last[hit]]
+        found[inside] = self.order[furthest[inside]]
+        return found
+
+    def _overlapping(self, s0, s1):
+        first = np.searchsorted(self.starts, s0 - self.max_length, side='left')
+        last = np.searchsorted(self.starts, s1, side='right')
+        candidates = np.arange(first, last)
+        return np.sort(self.order[candidates[self.ends[candidates] >= s0]])
+
+    def between(self, s0, s1):
+        if self.circumference > 0 and s1 - s0 >= self.circumference:
+            return np.arange(len(self.order))
+        s0, s1 = self._wrap(float(s0)), self._wrap(float(s1))
+        if s0 <= s1 or self.circumference <= 0:
+            return self._overlapping(s0, s1)
+        head = self._overlapping(s0, self.circumference)
+        tail = self._overlapping(0.0, s1)
+        return np.concatenate((head, tail[~np.isin(tail, head)]))
+
+
+class AttributeChange(object):
+    def __init__(self, table, attribute, indices, previous, values):
+        self._table = table
+        self.attribute = attribute
+        self._indices = indices
+        self.previous = previous
+        self.values = values
+
+    @property
+    def names(self):
+        return self._table.names[self._indices]
+
+    def undo(self):
+        self._table.set_attribute_column(self.attribute, self._indices, self.previous)
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __repr__(self):
+        return 'AttributeChange(' + self.attribute + ' of ' + str(len(self)) + ' elements)'
+
+
+def _type_codes(types):
+    if isinstance(types, str):
+        types = [types, ]
+    unknown = [t for t in types if t not in _ELEMENT_TYPE_CODES]
+    if unknown:
+        raise ValueError('Invalid element type(s) ' + ', '.join(unknown) + ' - expected one of ' +
+                         ', '.join(ELEMENT_TYPES))
+    return tuple(sorted(_ELEMENT_TYPE_CODES[t] for t in types))
+
+
+def _attribute_getter(element_class, attribute):
+    if attribute in element_class._typed_attributes:
+        java_getter = 'get' + _java_name(attribute)
+
+        def getter(jmadElement):
+            try:
+                method = jmadElement.__getattribute__(java_getter)
+            except AttributeError:
+                return np.nan
+            return _to_float(method())
+    else:
+        def getter(jmadElement):
+            # an attribute the element does not have is NaN - any other error is raised
+            if not jmadElement.getAttributeNames().contains(attribute):
+                return np.nan
+            return _to_float(jmadElement.getAttribute(attribute))
+
+    return getter
+
+
+def _attribute_setter(element_class, attribute):
+    if attribute in element_class._typed_attributes:
+        java_setter = 'set' + _java_name(attribute)
+
+        def setter(jmadElement, value):
+            jmadElement.__getattribute__(java_setter)(float(value))
+    else:
+        Double = java.lang.Double
+
+        def setter(jmadElement, value):
+            jmadElement.setAttribute(attribute, Double(float(value)))
+
+    return setter
+
+
+def _to_float(v):
+    if v is None:
+        return np.nan
+    elif hasattr(v, 'doubleValue'):
+        return v.doubleValue()
+    else:
+        return float(v)
 
 
 class Attributes(MutableMapping):
-    def __init__(self, jmadElement):
+    def __init__(self, jmadElement, state=None):
         self._jmadElement = jmadElement
+        self._state = state if state is not None else _ModelState()
 
     def __getitem__(self, k):
         return self._jmadElement.getAttribute(k).doubleValue()
 
     def __setitem__(self, k, v):
+        _track_attribute(self._state, self._jmadElement, k)
+        self._state.touch()
         return self._jmadElement.setAttribute(k, java.lang.Double(float(v)))
 
     def __delitem__(self, k):
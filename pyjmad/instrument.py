@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import functools
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+import pandas as pd
+
+_STAT_COLUMNS = ['calls', 'total', 'mean', 'max']
+_WRAPPED_DUNDERS = ('__getitem__', '__setitem__', '__delitem__', '__iter__', '__len__', '__contains__')
+
+_lock = threading.RLock()
+_enabled = False
+_explicit = False
+_active_profiles = 0
+_patches = []
+
+
+class _Recorder(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, key, elapsed):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+    def frame(self):
+        with self._lock:
+            rows = [(key, calls, total, total / calls, longest)
+                    for key, (calls, total, longest) in self._entries.items()]
+        frame = pd.DataFrame([r[1:] for r in rows], index=pd.Index([r[0] for r in rows], name='call'),
+                             columns=_STAT_COLUMNS)
+        return frame.sort_values('total', ascending=False)
+
+
+_global = _Recorder()
+# the patching is process-wide, but a profile only records the calls of the thread (or asyncio task) it runs in
+_profiles = contextvars.ContextVar('pyjmad_profiles', default=())
+
+
+def _record(key, elapsed):
+    _global.record(key, elapsed)
+    for recorder in _profiles.get():
+        recorder.record(key, elapsed)
+
+
+class _Phase(object):
+    __slots__ = ('_key', '_start')
+
+    def __init__(self, name):
+        self._key = 'phase ' + name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _record(self._key, time.perf_counter() - self._start)
+        return False
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    if not _enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def _timed(key, fn):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _record(key, time.perf_counter() - start)
+
+    return timed
+
+
+def _instrumented_classes():
+    from . import pyjmad, element
+    classes = [pyjmad.JMad, pyjmad.Model, pyjmad.ModelDefinition, pyjmad.SequenceDefinition, pyjmad.Beam,
+               pyjmad.MatchResult, pyjmad.PreparedMatch, pyjmad.Strengths, pyjmad.Elements, element.Attributes]
+    return classes + [c for c in element._ELEMENT_CLASSES.values() if c not in classes]
+
+
+def _patch_class(cls):
+    for name, member in list(cls.__dict__.items()):
+        if name.startswith('_') and name not in _WRAPPED_DUNDERS:
+            continue
+        key = cls.__name__ + '.' + name
+        if isinstance(member, property):
+            fget = _timed(key, member.fget) if member.fget is not None else None
+            fset = _timed(key + '=', member.fset) if member.fset is not None else None
+            patched = property(fget, fset, member.fdel, member.__doc__)
+        elif isinstance(member, types.FunctionType):
+            patched = _timed(key, member)
+        else:
+            continue
+        _patches.append((cls, name, member))
+        setattr(cls, name, patched)
+
+
+def _update():
+    # instrumentation stays on while enabled explicitly or while any profile is active
+    global _enabled
+    wanted = _explicit or _active_profiles > 0
+    if wanted and not _enabled:
+        for cls in _instrumented_classes():
+            _patch_class(cls)
+        _enabled = True
+    elif not wanted and _enabled:
+        _enabled = False
+        while _patches:
+            cls, name, member = _patches.pop()
+            setattr(cls, name, member)
+
+
+def enable():
+    global _explicit
+    with _lock:
+        _explicit = True
+        _update()
+
+
+def disable():
+    global _explicit
+    with _lock:
+        _explicit = False
+        _update()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    _global.reset()
+
+
+def stats():
+    return _global.frame()
+
+
+def report(frame, limit=None):
+    if limit is not None:
+        frame = frame.head(limit)
+    lines = ['{:<48} {:>9} {:>12} {:>12} {:>12}'.format('call', 'calls', 'total [ms]', 'mean [us]', 'max [ms]')]
+    for key, row in frame.iterrows():
+        lines.append('{:<48} {:>9d} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+            key, int(row['calls']), row['total'] * 1e3, row['mean'] * 1e6, row['max'] * 1e3))
+    return '\n'.join(lines)
+
+
+class Profile(object):
+    def __init__(self):
+        self._recorder = _Recorder()
+        self.elapsed = None
+
+    @property
+    def stats(self):
+        return self._recorder.frame()
+
+    def report(self, limit=None):
+        text = report(self.stats, limit)
+        if self.elapsed is not None:
+            text += '\n' + 'wall time: {:.3f} ms'.format(self.elapsed * 1e3)
+        return text
+
+    def dump(self, file=None, limit=None):
+        text = self.report(limit) + '\n'
+        if file is None:
+            sys.stdout.write(text)
+        elif hasattr(file, 'write'):
+            file.write(text)
+        else:
+            with open(file, 'w') as f:
+                f.write(text)
+
+
+@contextmanager
+def profile(dump=None, limit=None):
+    global _active_profiles
+    result = Profile()
+    with _lock:
+        _active_profiles += 1
+        _update()
+    _profiles.set(_profiles.get() + (result._recorder,))
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.elapsed = time.perf_counter() - start
+        _profiles.set(tuple(r for r in _profiles.get() if r is not result._recorder))
+        with _lock:
+            _active_profiles -= 1
+            _update()
+        if dump is not None:
+            result.dump(None if dump is True else dump, limit)
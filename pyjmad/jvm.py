@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import os
+import shlex
+import threading
+
+_lock = threading.Lock()
+_options = shlex.split(os.environ.get('PYJMAD_JVM_OPTIONS', ''))
+_jpype = []
+
+
+def configure_jvm(*options):
+    with _lock:
+        if _jpype:
+            raise RuntimeError('The JVM is already running - JVM options have to be configured before the first use '
+                               'of JMad')
+        _options.extend(options)
+
+
+def jvm_options():
+    return list(_options)
+
+
+def is_jvm_started():
+    return bool(_jpype)
+
+
+def start_jvm():
+    if _jpype:
+        return _jpype[0]
+    with _lock:
+        if not _jpype:
+            import jpype
+            import cmmnbuild_dep_manager
+            mgr = cmmnbuild_dep_manager.Manager('pyjmad')
+            if _options:
+                if jpype.isJVMStarted():
+                    logging.warning('JVM already running, ignoring JVM options ' + ' '.join(_options))
+                else:
+                    # same JVM and class path as the dependency manager, which then only does its post-start setup
+                    jpype.startJVM(jpype.getDefaultJVMPath(), '-Djava.class.path=' + mgr.class_path(), *_options)
+            _jpype.append(mgr.start_jpype_jvm())
+    return _jpype[0]
+
+
+class JavaPackage(object):
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = getattr(start_jvm().JPackage(self._name), name)
+        # packages and classes do not change - later lookups bypass __getattr__
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return 'JavaPackage(' + self._name + ')'
+
+
+class JavaClass(object):
+    def __init__(self, name):
+        self._name = name
+        self._class = None
+
+    def resolve(self):
+        if self._class is None:
+            root, *path = self._name.split('.')
+            self._class = functools.reduce(getattr, path, start_jvm().JPackage(root))
+        return self._class
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = getattr(self.resolve(), name)
+        setattr(self, name, value)
+        return value
+
+    def __call__(self, *args):
+        return self.resolve()(*args)
+
+    def __repr__(self):
+        return 'JavaClass(' + self._name + ')'
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from .pyjmad import cern, java, TfsResultRequestImpl, MadxTwissVariable, _jmad_TfsResult_columns, \
+    _tfs_columns_convert
+
+INITIAL_CONDITIONS = ('BETX', 'ALFX', 'MUX', 'BETY', 'ALFY', 'MUY',
+                      'DX', 'DPX', 'DY', 'DPY', 'X', 'PX', 'Y', 'PY')
+
+_TwissReference = namedtuple('_TwissReference', ['key', 'version', 'summary', 'columns', 'leaks'])
+
+
+def _reference_key(model):
+    jmadRange = model._jmadModel.getActiveRange()
+    return (model.optic,
+            str(jmadRange.getRangeDefinition().getSequenceDefinition().getName()),
+            str(jmadRange.getName()))
+
+
+def _full_twiss(model, variables, leaks=frozenset()):
+    wanted = list(OrderedDict.fromkeys(list(INITIAL_CONDITIONS) + list(variables)))
+    result = model.twiss(wanted, output='dict')
+    reference = _TwissReference(key=_reference_key(model), version=model._state.version,
+                                summary=result.summary, columns=result.data, leaks=leaks)
+    model._state.twiss_reference = reference
+    return reference
+
+
+def _current_twiss(model, reference, variables):
+    # a full twiss of the current model state, either the reference or any result in the twiss cache
+    if reference is not None and reference.key == _reference_key(model) and \
+            reference.version == model._state.version and all(v in reference.columns for v in variables):
+        return reference.summary, reference.columns
+    cached = model._cached_full_twiss(variables)
+    if cached is None:
+        return None
+    if isinstance(cached.data, dict):
+        return cached.summary, cached.data
+    columns = OrderedDict([('NAME', np.asarray(cached.data.index, dtype=object))])
+    for var in variables:
+        columns[var] = cached.data[var].values
+    return cached.summary, columns
+
+
+def _select(summary, columns, first, last, variables, output):
+    selected = OrderedDict([('NAME', columns['NAME'][first:last + 1])])
+    for var in variables:
+        selected[var] = columns[var][first:last + 1]
+    return _tfs_columns_convert(summary, selected, output)
+
+
+def _position(names, name, begin=0):
+    matches = np.nonzero(names[begin:] == name)[0]
+    if len(matches) == 0:
+        raise KeyError('Element ' + name + ' not found in the active range' +
+                       ('' if begin == 0 else ' after the start element'))
+    return begin + int(matches[0])
+
+
+def _select_wrapped(summary, columns, first, last, variables, output):
+    tail = _select(summary, columns, first, len(columns['NAME']) - 1, variables, 'dict')
+    head = _select(summary, columns, 0, last, variables, 'dict')
+    joined = OrderedDict((k, np.concatenate((tail.data[k], head.data[k]))) for k in tail.data)
+    return _tfs_columns_convert(summary, joined, output)
+
+
+def _initial_conditions(columns, first):
+    if first == 0:
+        return np.array([0.0 if var in ('MUX', 'MUY') else columns[var][-1] for var in INITIAL_CONDITIONS],
+                        dtype=float)
+    return np.array([columns[var][first - 1] for var in INITIAL_CONDITIONS], dtype=float)
+
+
+def _at(columns, last):
+    return np.array([columns[var][last] for var in INITIAL_CONDITIONS], dtype=float)
+
+
+def _agree(values, expected, tolerance):
+    return np.allclose(values, expected, rtol=tolerance, atol=tolerance)
+
+
+def _twiss_range(model, reference, first, last, variables):
+    RangeDefinitionImpl = cern.accsoft.steering.jmad.domain.machine.RangeDefinitionImpl
+    MadxRange = cern.accsoft.steering.jmad.domain.machine.MadxRange
+    TwissInitialConditionsImpl = cern.accsoft.steering.jmad.domain.twiss.TwissInitialConditionsImpl
+    names = reference.columns['NAME']
+    initialConditions = TwissInitialConditionsImpl('pyjmad-local-initial')
+    for var, value in zip(INITIAL_CONDITIONS, _initial_conditions(reference.columns, first)):
+        initialConditions.__getattribute__('set' + var.capitalize())(java.lang.Double(float(value)))
+
+    rangeDefinition = model._jmadModel.getActiveRange().getRangeDefinition()
+    localRange = RangeDefinitionImpl(rangeDefinition.getSequenceDefinition(), 'pyjmad-local',
+                                     MadxRange(str(names[first]), str(names[last])), initialConditions)
+    wanted = list(OrderedDict.fromkeys(list(INITIAL_CONDITIONS) + list(variables)))
+    request = TfsResultRequestImpl.createDefaultRequest()
+    for var in wanted:
+        request.addVariable(MadxTwissVariable._jmad_variable(var))
+    # the range is switched through the model, so that the element table and the state follow it
+    model.range = localRange
+    try:
+        local = _jmad_TfsResult_columns(model._jmadModel.twiss(request))
+    finally:
+        model.range = rangeDefinition
+    return local
+
+
+def _leaks(local, reference, last, tolerance):
+    if len(local['NAME']) == 0 or local['NAME'][-1] != reference.columns['NAME'][last]:
+        return True
+    return not _agree(_at(local, len(local['NAME']) - 1), _at(reference.columns, last), tolerance)
+
+
+def _changed_locally(previous, current, first, last, tolerance):
+    # the optics at both ends of the range are unchanged - a local twiss would have been valid
+    return _agree(_initial_conditions(current.columns, first), _initial_conditions(previous.columns, first),
+                  tolerance) and _agree(_at(current.columns, last), _at(previous.columns, last), tolerance)
+
+
+def twiss_local(model, start, end, variables, output='pandas', tolerance=1e-6):
+    if isinstance(variables, str):
+        variables = [variables, ]
+    variables = [str(v).upper() for v in variables if str(v).upper() != 'NAME']
+    reference = model._state.twiss_reference
+    current = _current_twiss(model, reference, variables)
+    if current is None and (reference is None or reference.key != _reference_key(model)):
+        reference = _full_twiss(model, variables)
+        current = reference.summary, reference.columns
+    names = reference.columns['NAME'] if current is None else current[1]['NAME']
+    first = _position(names, start)
+    try:
+        last = _position(names, end, first)
+    except KeyError:
+        last = None
+    if current is not None:
+        summary, columns = current
+        if last is None:
+            return _select_wrapped(summary, columns, first, _position(names, end), variables, output)
+        return _select(summary, columns, first, last, variables, output)
+
+    span = (str(start), str(end))
+    if last is None or span in reference.leaks:
+        if last is None:
+            logging.debug('Local twiss from ' + start + ' to ' + end + ' wraps around the origin - using a full twiss')
+            last = _position(names, end)
+        updated = _full_twiss(model, variables, reference.leaks)
+        if last >= first and _changed_locally(reference, updated, first, last, tolerance):
+            # the last changes stayed inside the range - try a local twiss again next time
+            updated = updated._replace(leaks=reference.leaks - {span})
+            model._state.twiss_reference = updated
+        if last < first:
+            return _select_wrapped(updated.summary, updated.columns, first, last, variables, output)
+        return _select(updated.summary, updated.columns, first, last, variables, output)
+
+    local = _twiss_range(model, reference, first, last, variables)
+    if _leaks(local, reference, last, tolerance):
+        logging.debug('Change between ' + start + ' and ' + end + ' is not local - using a full twiss')
+        # the next call for this range goes straight to a full twiss
+        updated = _full_twiss(model, variables, reference.leaks | {span})
+        return _select(updated.summary, updated.columns, first, last, variables, output)
+    return _select(reference.summary, local, 0, len(local['NAME']) - 1, variables, output)
@@ -1,5 +1,10 @@
 import itertools
+import json
 import logging
+import os
+import threading
+import time
+from collections import namedtuple
 
 from .pyjmad import org, java
 from .util import *
@@ -34,28 +39,162 @@ def _repo_from_uri(uri):
         raise ValueError('invalid repository URI: ' + uri)
 
 
+_PackageVariant = namedtuple('_PackageVariant', ['repository', 'package', 'kind', 'variant', 'full_name'])
+
+MODELPACK_CACHE_TTL = 7 * 24 * 3600
+
+
+def _default_cache_path():
+    cache_dir = os.environ.get('PYJMAD_CACHE_DIR')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pyjmad')
+    return os.path.join(cache_dir, 'modelpacks.json')
+
+
+class _ListingCache(object):
+    def __init__(self, path, ttl):
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self._path) as f:
+                content = json.load(f)
+            if content.get('version') == 1:
+                return content['repositories']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def load(self, repositories):
+        if self._path is None:
+            return None
+        with self._lock:
+            cached = self._read()
+        variants = []
+        for uri in repositories:
+            entry = cached.get(uri)
+            if entry is None or time.time() - entry['timestamp'] > self._ttl:
+                return None
+            variants += [_PackageVariant(uri, *v) for v in entry['variants']]
+        return variants
+
+    def store(self, repositories, variants):
+        if self._path is None:
+            return
+        if any(v.repository is None for v in variants):
+            logging.debug('Not caching ModelPack listing - repository of some variants unknown')
+            return
+        with self._lock:
+            cached = self._read()
+            now = time.time()
+            for uri in repositories:
+                cached[uri] = {'timestamp': now,
+                               'variants': [list(v[1:]) for v in variants if v.repository == uri]}
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                tmp_path = self._path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'version': 1, 'repositories': cached}, f, indent=1)
+                os.replace(tmp_path, self._path)
+            except (IOError, OSError):
+                logging.warning('Could not write ModelPack listing cache ' + self._path, exc_info=True)
+
+    def invalidate(self):
+        if self._path is None:
+            return
+        with self._lock:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
 class JMadModelPackService(object):
-    def __init__(self, applicationContext):
+    def __init__(self, applicationContext, cache_path='default', cache_ttl=MODELPACK_CACHE_TTL):
         self._javaService = applicationContext['jmadModelPackageService']
         self._javaRepositoryManager = applicationContext['packageRepositoryManager']
+        if cache_path == 'default':
+            cache_path = _default_cache_path()
+        self._listingCache = _ListingCache(cache_path, cache_ttl)
         self._modelpacks = {}
+        self.generation = 0
+        self._javaVariants = {}
+        self._fetchLock = threading.Lock()
+        self._refreshThread = None
         self._reload()
 
     def _reload(self):
-        def modelpack_name(pkg):
-            return str(pkg.modelPackage().name())
+        repositories = self.repositories
+        cached = self._listingCache.load(repositories)
+        if cached is not None:
+            logging.info('Using cached ModelPack listing for ' + str(repositories) + ', refreshing in background')
+            self._build(cached)
+            self._refresh_in_background()
+        else:
+            self._fetch()
 
-        logging.info('Fetching available ModelPacks from ' + str(self.repositories))
-        self._modelpacks = {}
-        modelpacks = list(self._javaService.availablePackages().collectList().block())
-        modelpacks.sort(key=modelpack_name)
-        for name, variants in itertools.groupby(modelpacks, modelpack_name):
-            self._modelpacks[name] = ModelPackType(self, name, variants)
+    def _fetch(self):
+        with self._fetchLock:
+            repositories = self.repositories
+            logging.info('Fetching available ModelPacks from ' + str(repositories))
+            self._apply(repositories, self._javaService.availablePackages().collectList().block())
+
+    async def reload_async(self):
+        from .aio import flux_to_future
+        logging.info('Fetching available ModelPacks asynchronously')
+        javaVariants = await flux_to_future(self._javaService.availablePackages())
+        with self._fetchLock:
+            self._apply(self.repositories, javaVariants)
+
+    def _apply(self, repositories, javaVariants):
+        self._javaVariants = {str(v.fullName()): v for v in javaVariants}
+        variants = [_describe_variant(v) for v in javaVariants]
+        self._build(variants)
+        self._listingCache.store(repositories, variants)
+
+    def _refresh_in_background(self):
+        def refresh():
+            from .pyjmad import _attach_thread_to_jvm
+            try:
+                _attach_thread_to_jvm()
+                self._fetch()
+            except Exception:
+                logging.warning('Background refresh of ModelPacks failed', exc_info=True)
+
+        self._refreshThread = threading.Thread(target=refresh, name='pyjmad-modelpack-refresh')
+        self._refreshThread.daemon = True
+        self._refreshThread.start()
+
+    def _java_variant(self, full_name):
+        if full_name not in self._javaVariants:
+            refreshThread = self._refreshThread
+            if refreshThread is not None and refreshThread.is_alive():
+                refreshThread.join()
+            if full_name not in self._javaVariants:
+                self._fetch()
+        try:
+            return self._javaVariants[full_name]
+        except KeyError:
+            raise KeyError('ModelPack ' + full_name + ' is no longer available')
+
+    def _build(self, variants):
+        def modelpack_name(variant):
+            return variant.package
+
+        variants = sorted(variants, key=modelpack_name)
+        loaded = {}
+        for name, package_variants in itertools.groupby(variants, modelpack_name):
+            loaded[name] = ModelPackType(self, name, package_variants)
+        self._modelpacks = loaded
+        self.generation += 1
 
     def refresh(self):
         logging.info('Clearing caches and reloading model packs ...')
+        self._listingCache.invalidate()
         self._javaService.clearCache().block()
-        self._reload()
+        self._fetch()
 
     @property
     def repositories(self):
@@ -97,25 +236,37 @@ class JMadModelPackService(object):
         return list(self._modelpacks.keys())
 
 
+def _variant_kind(modpack):
+    if str(modpack.variant().type()) == 'RELEASE':
+        return 'releases'
+    elif str(modpack.variant().type()) == 'BRANCH':
+        return 'branches'
+    elif str(modpack.variant().type()) == 'TAG':
+        return 'tags'
+    elif type(modpack.variant()) is org.jmad.modelpack.connect.embedded.domain.InternalPackageVariant:
+        return 'internal_models'
+    else:
+        return 'others'
+
+
+def _describe_variant(modpack):
+    try:
+        repository = _repo_to_uri(modpack.modelPackage().repository())
+    except Exception:
+        repository = None
+    return _PackageVariant(repository, str(modpack.modelPackage().name()), _variant_kind(modpack),
+                           str(modpack.variant().name()), str(modpack.fullName()))
+
+
 class ModelPackType(object):
     def __init__(self, service, name, variants):
         self._name = name
         self._all_variants = {}
-        for modpack in variants:
-            if str(modpack.variant().type()) == 'RELEASE':
-                variant = 'releases'
-            elif str(modpack.variant().type()) == 'BRANCH':
-                variant = 'branches'
-            elif str(modpack.variant().type()) == 'TAG':
-                variant = 'tags'
-            elif type(modpack.variant()) is org.jmad.modelpack.connect.embedded.domain.InternalPackageVariant:
-                variant = 'internal_models'
+        for variant in variants:
+            if variant.kind == 'internal_models':
+                self._all_variants[variant.kind] = ModelPack(service, variant)
             else:
-                variant = 'others'
-            if variant == 'internal_models':
-                self._all_variants[variant] = modpack
-            else:
-                self._all_variants.setdefault(variant, {})[modpack.variant().name()] = ModelPack(service, modpack)
+                self._all_variants.setdefault(variant.kind, {})[variant.variant] = ModelPack(service, variant)
 
     def __dir__(self):
         return ['name'] + list(self._all_variants.keys())
@@ -130,16 +281,29 @@ class ModelPackType(object):
 
 
 class ModelPack(object):
-    def __init__(self, service, javaModelPackVariant):
-        self._javaModelPackVariant = javaModelPackVariant
+    def __init__(self, service, variant):
+        self._variant = variant
         self._service = service
 
+    @property
+    def _javaModelPackVariant(self):
+        return self._service._java_variant(self._variant.full_name)
+
     @property
     def id(self):
-        return str(self._javaModelPackVariant.fullName())
+        return self._variant.full_name
 
     @property
     def models(self):
+        return self._models(self._service._javaService.modelDefinitionsFrom(
+            self._javaModelPackVariant).collectList().block())
+
+    async def models_async(self):
+        from .aio import flux_to_future
+        return self._models(await flux_to_future(
+            self._service._javaService.modelDefinitionsFrom(self._javaModelPackVariant)))
+
+    def _models(self, modeldefs):
         from .pyjmad import ModelDefinition
-        modeldefs = self._service._javaService.modelDefinitionsFrom(self._javaModelPackVariant).collectList().block()
-        return HtmlDict({str(mdef.getName()): ModelDefinition(mdef) for mdef in modeldefs})
+        origin = (self._variant.package, self._variant.kind, self._variant.variant)
+        return HtmlDict({str(mdef.getName()): ModelDefinition(mdef, origin) for mdef in modeldefs})
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import logging
+import traceback
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .parallel import model_spec, worker_pool, _worker_model
+
+OrbitCorrection = namedtuple('OrbitCorrection', ['kicks', 'orbit', 'predicted'])
+
+_PLANES = {'H': ('h_kick', 'X'), 'X': ('h_kick', 'X'),
+           'V': ('v_kick', 'Y'), 'Y': ('v_kick', 'Y')}
+
+_CORRECTOR_TYPES = {'X': ('HKICKER', 'KICKER'), 'Y': ('VKICKER', 'KICKER')}
+
+
+def _plane(plane):
+    try:
+        return _PLANES[str(plane).upper()]
+    except KeyError:
+        raise ValueError('Invalid plane ' + repr(plane) + ' - expected H or V')
+
+
+def _element_names(model, names, element_type, madx_types=None):
+    if names is None:
+        from .element import _ELEMENT_TYPE_CODES
+        table = model.elements._table
+        selected = table.type_codes == _ELEMENT_TYPE_CODES[element_type]
+        if madx_types is not None:
+            selected &= np.isin(table.madx_types, madx_types)
+        names = table.names[selected]
+    elif isinstance(names, str):
+        names = [names, ]
+    return list(OrderedDict.fromkeys(str(n) for n in names))
+
+
+def _correctors(model, name):
+    from .element import Corrector
+    elements = model.elements[name]
+    if not isinstance(elements, list):
+        elements = [elements, ]
+    for element in elements:
+        if not isinstance(element, Corrector):
+            raise ValueError(name + ' is not a Corrector but ' + str(element))
+    return elements
+
+
+def _orbit(model, variable, monitors, cache=False):
+    result = model.twiss([variable], output='dict', cache=cache)
+    index = {}
+    for i, name in enumerate(result.data['NAME']):
+        index.setdefault(str(name), i)
+    missing = [m for m in monitors if m not in index]
+    if missing:
+        raise ValueError('Monitors not found in the active range: ' + str(missing))
+    return np.asarray(result.data[variable], dtype=float)[[index[m] for m in monitors]]
+
+
+def response_columns(model, correctors, monitors, plane, delta):
+    from .element import Corrector, _attribute_getter, _attribute_setter
+    attribute, variable = _plane(plane)
+    # every kick is restored, so they are written directly - not tracked as modified and the model state is unchanged
+    get_kick = _attribute_getter(Corrector, attribute)
+    set_kick = _attribute_setter(Corrector, attribute)
+    reference = _orbit(model, variable, monitors)
+    columns = np.empty((len(monitors), len(correctors)))
+    for j, name in enumerate(correctors):
+        jmadElements = [e._jmadElement for e in _correctors(model, name)]
+        initial = [get_kick(e) for e in jmadElements]
+        try:
+            for jmadElement, kick in zip(jmadElements, initial):
+                set_kick(jmadElement, kick + delta)
+            columns[:, j] = (_orbit(model, variable, monitors) - reference) / delta
+        finally:
+            for jmadElement, kick in zip(jmadElements, initial):
+                set_kick(jmadElement, kick)
+    return columns
+
+
+def _response_worker(task):
+    index, correctors, monitors, plane, delta = task
+    try:
+        return index, response_columns(_worker_model(), correctors, monitors, plane, delta), None
+    except Exception:
+        return index, None, traceback.format_exc()
+
+
+class _CachedResponse(object):
+    def __init__(self, matrix, version):
+        self.matrix = matrix
+        self.version = version
+        self._svd = None
+
+    @property
+    def svd(self):
+        if self._svd is None:
+            self._svd = np.linalg.svd(self.matrix.values, full_matrices=False)
+        return self._svd
+
+
+def _cached_response(model, correctors, monitors, plane, delta, workers, cache):
+    _, variable = _plane(plane)
+    correctors = _element_names(model, correctors, 'Corrector', _CORRECTOR_TYPES[variable])
+    monitors = _element_names(model, monitors, 'Monitor')
+    sequence = model.sequence
+    key = (model.optic, None if sequence is None else str(sequence.name), str(model.range), variable,
+           tuple(correctors), tuple(monitors), float(delta))
+    # an entry is only valid for the model state it was computed in - any strength or element write replaces it
+    entry = model._state.response_cache.get(key) if cache else None
+    if entry is None or entry.version != model._state.version:
+        version = model._state.version
+        entry = _CachedResponse(_compute_response(model, correctors, monitors, plane, delta, workers), version)
+        model._state.response_cache[key] = entry
+    return entry
+
+
+def _compute_response(model, correctors, monitors, plane, delta, workers):
+    logging.info('Computing ' + str(len(monitors)) + 'x' + str(len(correctors)) + ' orbit response matrix')
+    if workers is None or workers <= 1 or len(correctors) <= 1:
+        data = response_columns(model, correctors, monitors, plane, delta)
+    else:
+        chunks = [list(c) for c in np.array_split(correctors, min(len(correctors), 4 * workers)) if len(c)]
+        tasks = [(i, c, monitors, plane, delta) for i, c in enumerate(chunks)]
+        blocks = {}
+        pool = worker_pool(model_spec(model), workers)
+        try:
+            for index, columns, error in pool.imap_unordered(_response_worker, tasks):
+                if error is not None:
+                    raise RuntimeError('Response matrix computation failed for ' + str(chunks[index]) + ':\n' + error)
+                blocks[index] = columns
+        finally:
+            pool.terminate()
+            pool.join()
+        data = np.hstack([blocks[i] for i in range(len(chunks))])
+    return pd.DataFrame(data, index=pd.Index(monitors, name='monitor'),
+                        columns=pd.Index(correctors, name='corrector'))
+
+
+def response_matrix(model, correctors=None, monitors=None, plane='H', delta=1e-6, workers=None, cache=True):
+    return _cached_response(model, correctors, monitors, plane, delta, workers, cache).matrix.copy()
+
+
+def correct_orbit(model, target=None, method='svd', ncut=0, plane='H', correctors=None, monitors=None,
+                  delta=1e-6, apply=True, workers=None):
+    if method != 'svd':
+        raise ValueError('Unsupported orbit correction method ' + repr(method) + ' - expected svd')
+    entry = _cached_response(model, correctors, monitors, plane, delta, workers, True)
+    correctors = list(entry.matrix.columns)
+    monitors = list(entry.matrix.index)
+    attribute, variable = _plane(plane)
+    orbit = _orbit(model, variable, monitors, cache=True)
+    if target is None:
+        target = np.zeros(len(monitors))
+    elif isinstance(target, pd.Series):
+        target = target.reindex(monitors).values.astype(float)
+        if np.isnan(target).any():
+            raise ValueError('Target orbit does not cover all monitors')
+    else:
+        target = np.broadcast_to(np.asarray(target, dtype=float), (len(monitors),))
+
+    u, s, vt = entry.svd
+    keep = int(np.count_nonzero(s > s[0] * 1e-12)) if len(s) else 0
+    keep = min(keep, len(s) - int(ncut))
+    if keep <= 0:
+        raise ValueError('No singular values left after cutting ' + str(ncut) + ' of ' + str(len(s)))
+    kicks = np.dot(vt[:keep].T, np.dot(u[:, :keep].T, target - orbit) / s[:keep])
+    predicted = orbit + np.dot(entry.matrix.values, kicks)
+    if apply:
+        for name, kick in zip(correctors, kicks):
+            for element in _correctors(model, name):
+                setattr(element, attribute, getattr(element, attribute) + kick)
+    return OrbitCorrection(kicks=pd.Series(kicks, index=entry.matrix.columns),
+                           orbit=pd.Series(orbit, index=entry.matrix.index),
+                           predicted=pd.Series(predicted, index=entry.matrix.index))
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import itertools
+import logging
+import multiprocessing
+import traceback
+from collections import namedtuple, OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+ModelSpec = namedtuple('ModelSpec', ['definition', 'origin', 'optic', 'sequence', 'range', 'strengths',
+                                     'attributes'])
+
+
+class ScanResult(namedtuple('ScanResult', ['points', 'names', 'variables', 'data', 'summary', 'errors'])):
+    __slots__ = ()
+
+    def save(self, path, append=False):
+        from .storage import save_scan
+        save_scan(path, self, append)
+
+
+def model_spec(model):
+    from .checkpoint import modified_attributes
+    sequence = model.sequence
+    optic = model.optic
+    return ModelSpec(definition=str(model.definition.name),
+                     origin=model.definition._origin,
+                     optic=None if optic is None else str(optic),
+                     sequence=None if sequence is None else str(sequence.name),
+                     range=str(model.range),
+                     strengths=model.strengths.to_series().to_dict(),
+                     attributes=modified_attributes(model))
+
+
+def create_replica(spec, jmad=None):
+    if jmad is None:
+        from .pyjmad import JMad
+        jmad = JMad()
+    if spec.origin is not None:
+        package, variant_kind, variant = spec.origin
+        modelpack = getattr(jmad.model_packs[package], variant_kind)
+        if variant_kind != 'internal_models':
+            modelpack = modelpack[variant]
+        definition = modelpack.models[spec.definition]
+    else:
+        definition = jmad.model_definitions[spec.definition]
+    model = jmad.create_model(definition)
+    if spec.sequence is not None:
+        model.sequence = spec.sequence
+    if spec.optic is not None:
+        model.optic = spec.optic
+    if spec.range is not None:
+        model.range = spec.range
+    model.strengths.update(spec.strengths)
+    if spec.attributes:
+        from .checkpoint import restore_attributes
+        restore_attributes(model, spec.attributes)
+    return model
+
+
+def worker_pool(spec, workers):
+    # a forked child would inherit the parent's JVM, which JPype does not support - always spawn
+    return multiprocessing.get_context('spawn').Pool(workers, initializer=_init_worker, initargs=(spec,))
+
+
+_worker = {'model': None, 'error': None, 'names_sent': False}
+
+
+def _init_worker(spec):
+    try:
+        _worker['model'] = create_replica(spec)
+    except Exception:
+        _worker['error'] = traceback.format_exc()
+
+
+def _worker_model():
+    if _worker['model'] is None:
+        raise RuntimeError('Model replica could not be created:\n' + str(_worker['error']))
+    return _worker['model']
+
+
+def scan_grid(grid):
+    if isinstance(grid, pd.DataFrame):
+        return grid.reset_index(drop=True).astype(float)
+    elif isinstance(grid, Mapping):
+        knobs = list(grid.keys())
+        axes = [np.atleast_1d(np.asarray(grid[k], dtype=float)) for k in knobs]
+        return pd.DataFrame(list(itertools.product(*axes)), columns=knobs)
+    else:
+        raise ValueError('Expecting a mapping of strength name -> values or a DataFrame of points')
+
+
+def scan_point(model, index, settings, variables):
+    try:
+        model.strengths.update(settings)
+        result = model.twiss(variables, output='dict', cache=False)
+        names = result.data['NAME']
+        data = np.column_stack([np.asarray(result.data[v], dtype=float) for v in variables]) \
+            if variables else np.empty((len(names), 0))
+        return index, names, data, result.summary, None
+    except Exception:
+        return index, None, None, None, traceback.format_exc()
+
+
+def _scan_worker(task):
+    index, settings, variables = task
+    try:
+        model = _worker_model()
+    except Exception:
+        return index, None, None, None, traceback.format_exc()
+    index, names, data, summary, error = scan_point(model, index, settings, variables)
+    if names is not None:
+        if _worker['names_sent']:
+            names = None
+        _worker['names_sent'] = True
+    return index, names, data, summary, error
+
+
+def run_scan(model, grid, variables, workers=None, progress=None, chunksize=1):
+    if isinstance(variables, str):
+        variables = [variables, ]
+    variables = [str(v).upper() for v in variables]
+    points = scan_grid(grid)
+    tasks = [(i, OrderedDict(row.items()), variables) for i, row in points.iterrows()]
+    total = len(tasks)
+    results = {}
+    names = None
+
+    def collect(result):
+        nonlocal names
+        index, point_names, data, summary, error = result
+        if names is None and point_names is not None:
+            names = point_names
+        results[index] = (data, summary, error)
+        if error is not None:
+            logging.warning('Scan point ' + str(index) + ' failed: ' + error.strip().splitlines()[-1])
+        if progress is not None:
+            progress(len(results), total)
+
+    if workers is None or workers <= 1:
+        knobs = list(points.columns)
+        initial = model.strengths.values_array(knobs) if knobs else []
+        try:
+            for task in tasks:
+                collect(scan_point(model, *task))
+        finally:
+            model.strengths.set_array(knobs, initial)
+    else:
+        pool = worker_pool(model_spec(model), workers)
+        try:
+            for result in pool.imap_unordered(_scan_worker, tasks, chunksize):
+                collect(result)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    n_elements = 0 if names is None else len(names)
+    data = np.full((total, n_elements, len(variables)), np.nan)
+    summaries = []
+    errors = OrderedDict()
+    for index in range(total):
+        point_data, summary, error = results[index]
+        if error is None and point_data.shape != data.shape[1:]:
+            error = 'Inconsistent twiss shape ' + str(point_data.shape) + ' - expected ' + str(data.shape[1:])
+        if error is not None:
+            errors[index] = error
+            summaries.append({})
+        else:
+            data[index] = point_data
+            summaries.append(summary)
+    logging.info('Scan finished: ' + str(total - len(errors)) + '/' + str(total) + ' points successful')
+    return ScanResult(points=points,
+                      names=np.array([] if names is None else names, dtype=object),
+                      variables=variables,
+                      data=data,
+                      summary=pd.DataFrame(summaries, index=points.index),
+                      errors=errors)
+
+
+def match_targets(targets):
+    from .matching import GlobalConstraint
+    if isinstance(targets, pd.DataFrame):
+        targets = [row.dropna().to_dict() for _, row in targets.iterrows()]
+    normalized = []
+    for target in targets:
+        if isinstance(target, Mapping):
+            target = GlobalConstraint(**target)
+        if isinstance(target, (list, tuple)):
+            normalized.append(list(target))
+        else:
+            normalized.append([target])
+    return normalized
+
+
+def _target_values(constraints):
+    from .matching import LocalConstraint
+    values = OrderedDict()
+    for constraint in constraints:
+        prefix = constraint.element + '.' if isinstance(constraint, LocalConstraint) else ''
+        for name in sorted(constraint.constraints):
+            values[prefix + name] = float(constraint.constraints[name])
+    return values
+
+
+def warm_start_order(vectors):
+    n = len(vectors)
+    if n == 0:
+        return []
+    scale = np.nanmax(vectors, axis=0) - np.nanmin(vectors, axis=0) if vectors.shape[1] else np.empty(0)
+    scale[~(scale > 0)] = 1.0
+    scaled = vectors / scale
+
+    def distances(i):
+        diff = np.abs(scaled - scaled[i])
+        diff[np.isnan(diff)] = 1.0
+        return diff.sum(axis=1)
+
+    order = [(0, None)]
+    done = np.zeros(n, dtype=bool)
+    done[0] = True
+    best = distances(0)
+    parent = np.zeros(n, dtype=int)
+    while len(order) < n:
+        best[done] = np.inf
+        i = int(np.argmin(best))
+        order.append((i, int(parent[i])))
+        done[i] = True
+        d = distances(i)
+        closer = d < best
+        best[closer] = d[closer]
+        parent[closer] = i
+    return order
+
+
+def match_chain(model, chain, varies, solved=None, prepared=None):
+    solved = {} if solved is None else solved
+    prepared = {} if prepared is None else prepared
+    results = []
+    for index, constraints, parent in chain:
+        try:
+            if parent in solved:
+                model.strengths.update(solved[parent])
+            targets = _target_values(constraints)
+            request = prepared.get(tuple(targets))
+            if request is None:
+                request = prepared[tuple(targets)] = model.prepare_match(*(list(constraints) + list(varies)))
+            result = request(targets)
+            solved[index] = OrderedDict((v.strength, model.strengths[v.strength]) for v in varies)
+            results.append((index,
+                            OrderedDict((str(k), float(v)) for k, v in result.vary_results.items()),
+                            float(result.final_penalty),
+                            OrderedDict((str(k), float(v)) for k, v in result.constraint_results.items()),
+                            None))
+        except Exception:
+            results.append((index, None, None, None, traceback.format_exc()))
+    return results
+
+
+def _match_worker(task):
+    chain, varies = task
+    try:
+        model = _worker_model()
+    except Exception:
+        error = traceback.format_exc()
+        return [(index, None, None, None, error) for index, _, _ in chain]
+    return match_chain(model, chain, varies)
+
+
+def run_match_many(model, targets, varies, workers=None, progress=None):
+    from .matching import Vary
+    varies = list(varies)
+    for vary in varies:
+        if not isinstance(vary, Vary):
+            raise ValueError('Expecting Vary - but got ' + str(type(vary)))
+    targets = match_targets(targets)
+    target_values = pd.DataFrame([_target_values(t) for t in targets], index=pd.RangeIndex(len(targets)))
+    order = warm_start_order(target_values.values.astype(float))
+    total = len(order)
+    results = {}
+
+    def collect(chain_results):
+        for result in chain_results:
+            index, error = result[0], result[-1]
+            results[index] = result
+            if error is not None:
+                logging.warning('Match of target ' + str(index) + ' failed: ' + error.strip().splitlines()[-1])
+        if progress is not None:
+            progress(len(results), total)
+
+    if workers is None or workers <= 1:
+        knobs = [v.strength for v in varies]
+        initial = model.strengths.values_array(knobs) if knobs else []
+        solved = {}
+        prepared = {}
+        try:
+            for index, parent in order:
+                collect(match_chain(model, [(index, targets[index], parent)], varies, solved, prepared))
+        finally:
+            model.strengths.set_array(knobs, initial)
+    else:
+        chains = []
+        for chunk in np.array_split(np.arange(total), min(workers, total)):
+            members = set(order[i][0] for i in chunk)
+            chains.append([(order[i][0], targets[order[i][0]], order[i][1] if order[i][1] in members else None)
+                           for i in chunk])
+        pool = worker_pool(model_spec(model), workers)
+        try:
+            for chain_results in pool.imap_unordered(_match_worker, [(c, varies) for c in chains]):
+                collect(chain_results)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    index = target_values.index
+    vary_results = pd.DataFrame([results[i][1] or {} for i in index], index=index)
+    constraint_results = pd.DataFrame([results[i][3] or {} for i in index], index=index)
+    frame = pd.concat(OrderedDict([('target', target_values),
+                                   ('vary', vary_results),
+                                   ('constraint', constraint_results)]), axis=1)
+    frame['penalty'] = [np.nan if results[i][2] is None else results[i][2] for i in index]
+    frame['error'] = [results[i][4] for i in index]
+    failed = frame['error'].notnull().sum()
+    logging.info('Match sweep finished: ' + str(total - failed) + '/' + str(total) + ' targets successful')
+    return frame
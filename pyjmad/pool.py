@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+
+from .pyjmad import _attach_thread_to_jvm
+
+PoolStats = namedtuple('PoolStats', ['size', 'available', 'checkouts', 'waits', 'total_wait', 'max_wait'])
+
+# queued once the last model is dropped, so that waiting checkouts fail instead of blocking forever
+_EXHAUSTED = object()
+
+
+class ModelPool(object):
+    def __init__(self, jmad, definition, optic=None, sequence=None, range=None, size=4):
+        self._jmad = jmad
+        self._definition = definition
+        self._setup = (optic, sequence, range)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        models = []
+        while len(models) < size:
+            models.append(self._create_model())
+        baseline = models[0].strengths.to_series()
+        self._baseline_names = list(baseline.index)
+        self._baseline_values = baseline.values
+        self._baseline_setup = (models[0].optic, models[0].sequence.name, models[0].range)
+        for model in models:
+            self._queue.put(model)
+            self._size += 1
+
+    def _create_model(self):
+        optic, sequence, range = self._setup
+        model = self._jmad.create_model(self._definition)
+        if sequence is not None:
+            model.sequence = sequence
+        if optic is not None:
+            model.optic = optic
+        if range is not None:
+            model.range = range
+        return model
+
+    @contextmanager
+    def model(self, timeout=None):
+        _attach_thread_to_jvm()
+        start = time.perf_counter()
+        try:
+            model = self._queue.get_nowait()
+            waited = False
+        except queue.Empty:
+            model = self._queue.get(timeout=timeout)
+            waited = True
+        if model is _EXHAUSTED:
+            self._queue.put(model)
+            raise RuntimeError('No models left in the pool - all failed to reset and could not be replaced')
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            yield model
+        finally:
+            self._return(model)
+
+    def _return(self, model):
+        try:
+            self._restore(model)
+        except Exception:
+            logging.exception('Failed to restore pooled model, resetting it')
+            try:
+                model.reset()
+                self._restore(model)
+            except Exception:
+                logging.exception('Failed to reset pooled model, replacing it')
+                model = self._replace()
+                if model is None:
+                    return
+        self._queue.put(model)
+
+    def _replace(self):
+        try:
+            return self._create_model()
+        except Exception:
+            logging.exception('Failed to create a replacement model, dropping it from the pool')
+            with self._lock:
+                self._size -= 1
+                exhausted = self._size == 0
+            if exhausted:
+                self._queue.put(_EXHAUSTED)
+            return None
+
+    def _restore(self, model):
+        optic, sequence, range = self._baseline_setup
+        if model.sequence.name != sequence:
+            model.sequence = sequence
+        if model.optic != optic:
+            model.optic = optic
+        if model.range != range:
+            model.range = range
+        current = model.strengths.values_array(self._baseline_names)
+        changed = np.nonzero(current != self._baseline_values)[0]
+        if len(changed) > 0:
+            model.strengths.set_array([self._baseline_names[i] for i in changed], self._baseline_values[changed])
+
+    @property
+    def stats(self):
+        with self._lock:
+            return PoolStats(size=self._size, available=self._queue.qsize() if self._size else 0,
+                             checkouts=self._checkouts,
+                             waits=self._waits, total_wait=self._total_wait, max_wait=self._max_wait)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return 'ModelPool(' + ', '.join(k + '=' + str(v) for k, v in self.stats._asdict().items()) + ')'
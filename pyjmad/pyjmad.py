@@ -1,97 +1,226 @@
 # -*- coding: utf-8 -*-
-from collections import namedtuple, MutableMapping, Mapping, OrderedDict
+from collections import namedtuple, OrderedDict
+from collections.abc import MutableMapping, Mapping, Hashable
 
 import numpy as np
 import pandas as pd
-import re, site, logging
+import re, site, logging, threading, time
+from contextlib import contextmanager
 
-import cmmnbuild_dep_manager
+from .jvm import JavaPackage, JavaClass, configure_jvm, jvm_options, is_jvm_started, start_jvm
 
-mgr = cmmnbuild_dep_manager.Manager('pyjmad')
-
-jpype = mgr.start_jpype_jvm()
-
-cern = jpype.JPackage('cern')
-org = jpype.JPackage('org')
-java = jpype.JPackage('java')
-com = jpype.JPackage('com')
+# the JVM is started on the first use of a Java package or class, not on import
+cern = JavaPackage('cern')
+org = JavaPackage('org')
+java = JavaPackage('java')
+com = JavaPackage('com')
 
 from .spring import SpringApplicationContext
 
 from .modelpack import JMadModelPackService
+from .cache import TwissCache
+from . import instrument
 from .util import *
+from .util import _ModelState
+
+JMadServiceFactory = JavaClass('cern.accsoft.steering.jmad.service.JMadServiceFactory')
+Doubles = JavaClass('com.google.common.primitives.Doubles')
+JMadGui = JavaClass('cern.accsoft.steering.jmad.gui.JMad')
+JMadGuiPreferencesImpl = JavaClass('cern.accsoft.steering.jmad.gui.manage.impl.JMadGuiPreferencesImpl')
+TfsResultRequestImpl = JavaClass('cern.accsoft.steering.jmad.domain.result.tfs.TfsResultRequestImpl')
+Iterables = JavaClass('com.google.common.collect.Iterables')
+
 
-JMadServiceFactory = cern.accsoft.steering.jmad.service.JMadServiceFactory
-Doubles = com.google.common.primitives.Doubles
-JMadGui = cern.accsoft.steering.jmad.gui.JMad
-JMadGuiPreferencesImpl = cern.accsoft.steering.jmad.gui.manage.impl.JMadGuiPreferencesImpl
-TfsResultRequestImpl = cern.accsoft.steering.jmad.domain.result.tfs.TfsResultRequestImpl
-Iterables = com.google.common.collect.Iterables
+_JMadServices = namedtuple('_JMadServices', ['spring_context', 'jmad_service', 'model_packs'])
+_shared_services = {}
+_shared_services_lock = threading.Lock()
+_log4j_configured = []
 
 
 class JMad(object):
-    def __init__(self, logLevel=None):
-        log4j = org.apache.log4j
-        if log4j.BasicConfigurator is not None and callable(log4j.BasicConfigurator.configure):
-            log4j.BasicConfigurator.configure()
-            if logLevel is not None:
-                log4j.Logger.getRootLogger().setLevel(log4j.Level.toLevel(logLevel))
+    def __init__(self, logLevel=None, headless=False, shared=True):
+        self.startup_times = OrderedDict()
+        with _startup_phase(self.startup_times, 'jvm'):
+            start_jvm()
+        with _startup_phase(self.startup_times, 'logging'):
+            _configure_log4j(logLevel)
+        with _shared_services_lock:
+            services = _lookup_shared_services(headless) if shared else None
+            if services is None:
+                services = _create_services(headless, self.startup_times)
+                if shared:
+                    _shared_services[headless] = services
             else:
-                log4j.Logger.getRootLogger().setLevel(log4j.Level.WARN)
-        try:
-            try:
-                self._springContext = SpringApplicationContext(
-                    cern.accsoft.steering.jmad.gui.config.JMadGuiStandaloneConfiguration)
-            except:
-                logging.info("Could not instantiate GUI context, trying headless context")
-                self._springContext = SpringApplicationContext(
-                    org.jmad.modelpack.service.conf.JMadModelPackageServiceStandaloneConfiguration)
-
-            self._jmadService = self._springContext['jmadService']
-            self.model_packs = JMadModelPackService(self._springContext)
-        except:
-            logging.exception("JMad Model Pack Service not available, falling back")
-            self._jmadService = JMadServiceFactory.createJMadService()
+                self.startup_times['shared_services'] = 0.0
+        self._springContext = services.spring_context
+        self._jmadService = services.jmad_service
+        self.model_packs = services.model_packs
         self._jmadModelDefinitionManager = self._jmadService.getModelDefinitionManager()
         self._jmadModelManager = self._jmadService.getModelManager()
+        self._modelDefinitionIndex = None
+        self._modelDefinitionGeneration = None
+        logging.info('JMad startup: ' + ', '.join(k + '=' + '{:.3f}s'.format(v)
+                                                  for k, v in self.startup_times.items()))
 
     @property
     def model_definitions(self):
-        return HtmlDict({m.getName(): ModelDefinition(m) for m in
-                         self._jmadModelDefinitionManager.getAllModelDefinitions()})
+        return self._model_definition_index()[0]
+
+    def _model_definition_index(self):
+        generation = self.model_packs.generation if self.model_packs is not None else 0
+        if self._modelDefinitionIndex is None or self._modelDefinitionGeneration != generation:
+            definitions = HtmlDict({str(m.getName()): ModelDefinition(m) for m in
+                                    self._jmadModelDefinitionManager.getAllModelDefinitions()})
+            self._modelDefinitionIndex = (definitions, {k.lower(): v for k, v in definitions.items()})
+            self._modelDefinitionGeneration = generation
+        return self._modelDefinitionIndex
+
+    def _model_definition(self, name):
+        definitions, definitions_lower = self._model_definition_index()
+        model = definitions.get(name)
+        if model is None:
+            model = definitions_lower.get(name.lower())
+        if model is None:
+            raise KeyError('Invalid Model Definition: ' + name)
+        return model
 
     def create_model(self, model):
         if type(model) is str:
-            model = self.model_definitions[model]
+            model = self._model_definition(model)
         elif type(model) is not ModelDefinition:
             model = ModelDefinition(model)
-        return Model(self._jmadService.createModel(model._jmadModelDefinition))
+        return Model(self._jmadService.createModel(model._jmadModelDefinition), model)
+
+    def create_model_async(self, model):
+        from .aio import run_in_executor, shared_executor
+        return run_in_executor(shared_executor(), self.create_model, model)
 
     def open_jmad_gui(self):
+        if self._springContext is None or 'jmadGui' not in self._springContext.bean_definitions():
+            raise RuntimeError('JMad GUI not available - JMad was started headless or without Spring context')
         gui = self._springContext['jmadGui']
         gui.getJmadGuiPreferences().setCleanupOnClose(False)
         gui.getJmadGuiPreferences().setExitOnClose(False)
         gui.getJmadGuiPreferences().setMainFrame(False)
-        jpype.setupGuiEnvironment(lambda: gui.show())
+        start_jvm().setupGuiEnvironment(lambda: gui.show())
+
+
+@contextmanager
+def _startup_phase(startup_times, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_times[phase] = time.perf_counter() - start
+
+
+def _configure_log4j(logLevel):
+    log4j = org.apache.log4j
+    if log4j.BasicConfigurator is not None and callable(log4j.BasicConfigurator.configure):
+        if not _log4j_configured:
+            log4j.BasicConfigurator.configure()
+            _log4j_configured.append(True)
+        if logLevel is not None:
+            log4j.Logger.getRootLogger().setLevel(log4j.Level.toLevel(logLevel))
+        else:
+            log4j.Logger.getRootLogger().setLevel(log4j.Level.WARN)
+
+
+def _lookup_shared_services(headless):
+    services = _shared_services.get(headless)
+    if services is None and headless:
+        # a full GUI context is a superset of the headless one
+        services = _shared_services.get(False)
+    return services
+
+
+def _create_services(headless, startup_times):
+    springContext = None
+    modelPacks = None
+    try:
+        with _startup_phase(startup_times, 'spring_context'):
+            if not headless:
+                try:
+                    springContext = SpringApplicationContext(
+                        cern.accsoft.steering.jmad.gui.config.JMadGuiStandaloneConfiguration)
+                except:
+                    logging.info("Could not instantiate GUI context, trying headless context")
+            if springContext is None:
+                springContext = SpringApplicationContext(
+                    org.jmad.modelpack.service.conf.JMadModelPackageServiceStandaloneConfiguration)
+        jmadService = springContext['jmadService']
+        with _startup_phase(startup_times, 'model_packs'):
+            modelPacks = JMadModelPackService(springContext)
+    except:
+        logging.exception("JMad Model Pack Service not available, falling back")
+        with _startup_phase(startup_times, 'jmad_service'):
+            jmadService = JMadServiceFactory.createJMadService()
+    return _JMadServices(springContext, jmadService, modelPacks)
 
 
 class Model(object):
-    def __init__(self, jmadModel):
+    def __init__(self, jmadModel, definition=None):
         self._jmadModel = jmadModel
-        self.definition = ModelDefinition(jmadModel.getModelDefinition())
+        self._state = _ModelState()
+        self._executor = None
+        self.twiss_cache = TwissCache()
+        self.definition = definition if definition is not None else ModelDefinition(jmadModel.getModelDefinition())
         if not jmadModel.isInitialized():
             jmadModel.init()
 
-    def twiss(self, variables, element_filter=None):
+    def twiss(self, variables, element_filter=None, output='pandas', cache=True):
         if isinstance(variables, str):
             variables = [variables, ]
-        request = TfsResultRequestImpl.createDefaultRequest()
-        for var in variables:
-            request.addVariable(MadxTwissVariable._jmad_variable(var))
-        if element_filter is not None:
-            request.addElementFilter(element_filter)
-        tfs_result = self._jmadModel.twiss(request)
-        return _jmad_TfsResult_to_pandas(tfs_result)
+        if cache and element_filter is not None and not isinstance(element_filter, Hashable):
+            cache = False
+        if cache:
+            key = self._twiss_cache_key(variables, element_filter, output)
+            result = self.twiss_cache.get(key)
+            if result is not None:
+                return result
+        result = self._twiss(variables, element_filter, output)
+        if cache:
+            self.twiss_cache.put(key, result)
+        return result
+
+    def twiss_async(self, variables, element_filter=None, output='pandas', cache=True):
+        from .aio import run_in_executor
+        return run_in_executor(self._async_executor(), self.twiss, variables, element_filter, output, cache)
+
+    def _async_executor(self):
+        if self._executor is None:
+            from .aio import model_executor
+            self._executor = model_executor()
+        return self._executor
+
+    def _twiss(self, variables, element_filter, output):
+        with instrument.phase('twiss.request'):
+            request = TfsResultRequestImpl.createDefaultRequest()
+            for var in variables:
+                request.addVariable(MadxTwissVariable._jmad_variable(var))
+            if element_filter is not None:
+                request.addElementFilter(element_filter)
+        with instrument.phase('twiss.madx'):
+            tfs_result = self._jmadModel.twiss(request)
+        with instrument.phase('twiss.convert'):
+            return _jmad_TfsResult_convert(tfs_result, output)
+
+    def _twiss_cache_key(self, variables, element_filter, output):
+        jmadRange = self._jmadModel.getActiveRange()
+        return (self.optic,
+                str(jmadRange.getRangeDefinition().getSequenceDefinition().getName()),
+                str(jmadRange.getName()),
+                tuple(str(v).upper() for v in variables),
+                element_filter,
+                output,
+                self._state.version)
+
+    def _cached_full_twiss(self, variables):
+        # the newest cached unfiltered twiss of the current state holding all variables - not counted as a lookup
+        optic, sequence, range, _, _, _, version = self._twiss_cache_key((), None, None)
+        wanted = set(str(v).upper() for v in variables)
+        return self.twiss_cache.find(lambda key: key[:3] == (optic, sequence, range) and key[4] is None and
+                                     key[5] in ('pandas', 'dict') and key[6] == version and wanted <= set(key[3]))
 
     @property
     def name(self):
@@ -111,6 +240,8 @@ class Model(object):
         if jmadOptic is None:
             raise ValueError('Invalid Optic: ' + optic)
         self._jmadModel.setActiveOpticsDefinition(jmadOptic)
+        self._state.strength_index = None
+        self._state.touch()
 
     @property
     def sequence(self):
@@ -126,6 +257,7 @@ class Model(object):
         if jmadSequence is None:
             raise ValueError('Invalid sequence: ' + sequence)
         self._jmadModel.setActiveRangeDefinition(jmadSequence.getDefaultRangeDefinition())
+        self._state.touch()
 
     @property
     def range(self):
@@ -134,14 +266,21 @@ class Model(object):
     @range.setter
     def range(self, range):
         self._jmadModel.setActiveRangeDefinition(self.sequence._jmad_rangeDefinition(range))
+        self._state.touch()
 
     @property
     def strengths(self):
-        return Strengths(self._jmadModel)
+        return Strengths(self._jmadModel, self._state)
 
     @property
     def elements(self):
-        return Elements(self._jmadModel.getActiveRange())
+        from .element import _ElementTable
+        jmadRange = self._jmadModel.getActiveRange()
+        table = self._state.element_table
+        if table is None or not table.jmad_range.equals(jmadRange):
+            table = _ElementTable.from_range(jmadRange, self._state)
+            self._state.element_table = table
+        return Elements(table, self._state)
 
     @property
     def beam(self):
@@ -149,40 +288,56 @@ class Model(object):
 
     def reset(self):
         self._jmadModel.reset()
+        self._state.strength_index = None
+        self._state.created_strengths = {}
+        self._state.element_table = None
+        self._state.modified_attributes = {}
+        self._state.touch()
+
+    def checkpoint(self):
+        from .checkpoint import checkpoint
+        return checkpoint(self)
+
+    def restore(self, checkpoint):
+        from .checkpoint import restore
+        return restore(self, checkpoint)
 
     def match(self, *args):
-        MatchResultRequestImpl = cern.accsoft.steering.jmad.domain.result.match.MatchResultRequestImpl
-        MadxVaryParameterImpl = cern.accsoft.steering.jmad.domain.result.match.input.MadxVaryParameterImpl
-        MatchConstraintGlobal = cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintGlobal
-        MatchConstraintLocal = cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintLocal
-        MadxParameterImpl = cern.accsoft.steering.jmad.domain.knob.MadxParameterImpl
-        MadxRange = cern.accsoft.steering.jmad.domain.machine.MadxRange
-        from .matching import LocalConstraint, GlobalConstraint, Vary
-        jmadRequest = MatchResultRequestImpl()
-        for arg in args:
-            if isinstance(arg, LocalConstraint):
-                jmadConstraint = MatchConstraintLocal(MadxRange(arg.element))
-                for c, v in arg.constraints.items():
-                    jmadConstraint.__getattribute__('set' + (c.capitalize()))(java.lang.Double(float(v)))
-                jmadRequest.addMatchConstraint(jmadConstraint)
-            elif isinstance(arg, GlobalConstraint):
-                jmadConstraint = MatchConstraintGlobal()
-                for c, v in arg.constraints.items():
-                    jmadConstraint.__getattribute__('set' + (c.capitalize()))(java.lang.Double(float(v)))
-                jmadRequest.addMatchConstraint(jmadConstraint)
-            elif isinstance(arg, Vary):
-                jmadVary = MadxVaryParameterImpl(MadxParameterImpl(arg.strength))
-                if arg.lower_bound is not None:
-                    jmadVary.setLower(java.lang.Double(float(arg.lower_bound)))
-                if arg.upper_bound is not None:
-                    jmadVary.setUpper(java.lang.Double(float(arg.upper_bound)))
-                if arg.step is not None:
-                    jmadVary.setStep(java.lang.Double(float(arg.step)))
-                jmadRequest.addMadxVaryParameter(jmadVary)
-            else:
-                raise ValueError('Expecting LocalConstraint, GlobalConstraint, Vary - but got ' + str(type(arg)))
+        return self.prepare_match(*args)()
+
+    def prepare_match(self, *args):
+        with instrument.phase('match.request'):
+            return PreparedMatch(self, *args)
+
+    def match_async(self, *args):
+        from .aio import run_in_executor
+        return run_in_executor(self._async_executor(), self.match, *args)
+
+    def match_many(self, targets, varies, workers=None, progress=None):
+        from .parallel import run_match_many
+        return run_match_many(self, targets, varies, workers, progress)
+
+    def twiss_local(self, start, end, variables, output='pandas', tolerance=1e-6):
+        from .local import twiss_local
+        return twiss_local(self, start, end, variables, output, tolerance)
 
-        return MatchResult(self._jmadModel.match(jmadRequest))
+    def response_matrix(self, correctors=None, monitors=None, plane='H', delta=1e-6, workers=None, cache=True):
+        from .orbit import response_matrix
+        return response_matrix(self, correctors, monitors, plane, delta, workers, cache)
+
+    def correct_orbit(self, target=None, method='svd', ncut=0, plane='H', correctors=None, monitors=None,
+                      delta=1e-6, apply=True, workers=None):
+        from .orbit import correct_orbit
+        return correct_orbit(self, target, method, ncut, plane, correctors, monitors, delta, apply, workers)
+
+    def scan(self, grid, variables, workers=None, progress=None, chunksize=1):
+        from .parallel import run_scan
+        return run_scan(self, grid, variables, workers, progress, chunksize)
+
+    def iter_twiss(self, settings, variables, element_filter=None, output='pandas', sink=None, append=False,
+                   restore=True):
+        from .replay import iter_twiss
+        return iter_twiss(self, settings, variables, element_filter, output, sink, append, restore)
 
     def __str__(self):
         return self.name + ' - ' + str(self.optic) + ' - ' + str(self.sequence) + ' - ' + str(self.range)
@@ -192,8 +347,11 @@ class Model(object):
 
 
 class ModelDefinition(object):
-    def __init__(self, jmadModelDefinition):
+    def __init__(self, jmadModelDefinition, origin=None):
         self._jmadModelDefinition = jmadModelDefinition
+        self._origin = origin
+        self._optics = None
+        self._sequences = None
 
     @property
     def name(self):
@@ -201,11 +359,15 @@ class ModelDefinition(object):
 
     @property
     def optics(self):
-        return [o.getName() for o in self._jmadModelDefinition.getOpticsDefinitions()]
+        if self._optics is None:
+            self._optics = [o.getName() for o in self._jmadModelDefinition.getOpticsDefinitions()]
+        return list(self._optics)
 
     @property
     def sequences(self):
-        return [SequenceDefinition(o) for o in self._jmadModelDefinition.getSequenceDefinitions()]
+        if self._sequences is None:
+            self._sequences = [SequenceDefinition(o) for o in self._jmadModelDefinition.getSequenceDefinitions()]
+        return list(self._sequences)
 
     def _jmad_opticDefinition(self, optic):
         if isinstance(optic, str):
@@ -396,26 +558,243 @@ class MatchResult(object):
                '   Constraint Results: ' + repr(self.constraint_results) + '\n'
 
 
+class PreparedMatch(object):
+    def __init__(self, model, *args):
+        MatchResultRequestImpl = cern.accsoft.steering.jmad.domain.result.match.MatchResultRequestImpl
+        MadxVaryParameterImpl = cern.accsoft.steering.jmad.domain.result.match.input.MadxVaryParameterImpl
+        MatchConstraintGlobal = cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintGlobal
+        MatchConstraintLocal = cern.accsoft.steering.jmad.domain.result.match.input.MatchConstraintLocal
+        MadxParameterImpl = cern.accsoft.steering.jmad.domain.knob.MadxParameterImpl
+        MadxRange = cern.accsoft.steering.jmad.domain.machine.MadxRange
+        from .matching import LocalConstraint, GlobalConstraint, Vary
+        self._model = model
+        self._Double = java.lang.Double
+        self._setters = OrderedDict()
+        self._targets = OrderedDict()
+        self._varies = []
+        self._jmadRequest = MatchResultRequestImpl()
+        for arg in args:
+            if isinstance(arg, LocalConstraint):
+                jmadConstraint = MatchConstraintLocal(MadxRange(arg.element))
+                self._add_constraint(jmadConstraint, arg.element + '.', arg.constraints)
+            elif isinstance(arg, GlobalConstraint):
+                jmadConstraint = MatchConstraintGlobal()
+                self._add_constraint(jmadConstraint, '', arg.constraints)
+            elif isinstance(arg, Vary):
+                jmadVary = MadxVaryParameterImpl(MadxParameterImpl(arg.strength))
+                if arg.lower_bound is not None:
+                    jmadVary.setLower(self._Double(float(arg.lower_bound)))
+                if arg.upper_bound is not None:
+                    jmadVary.setUpper(self._Double(float(arg.upper_bound)))
+                if arg.step is not None:
+                    jmadVary.setStep(self._Double(float(arg.step)))
+                self._jmadRequest.addMadxVaryParameter(jmadVary)
+                self._varies.append(arg.strength)
+            else:
+                raise ValueError('Expecting LocalConstraint, GlobalConstraint, Vary - but got ' + str(type(arg)))
+
+    def _add_constraint(self, jmadConstraint, prefix, constraints):
+        for c in sorted(constraints):
+            key = prefix + c
+            if key in self._setters:
+                raise ValueError('Duplicate match constraint: ' + key)
+            self._setters[key] = jmadConstraint.__getattribute__('set' + (c.capitalize()))
+            self._targets[key] = float(constraints[c])
+            self._setters[key](self._Double(self._targets[key]))
+        self._jmadRequest.addMatchConstraint(jmadConstraint)
+
+    @property
+    def targets(self):
+        return OrderedDict(self._targets)
+
+    @property
+    def varies(self):
+        return list(self._varies)
+
+    def update(self, targets=None, **kwargs):
+        if targets is not None:
+            kwargs = dict(targets, **kwargs)
+        for key, value in kwargs.items():
+            if key not in self._setters:
+                raise KeyError('Unknown match target ' + key + ' - expected one of ' + str(list(self._setters)))
+            value = float(value)
+            if value != self._targets[key]:
+                self._setters[key](self._Double(value))
+                self._targets[key] = value
+
+    def __call__(self, targets=None, **kwargs):
+        with instrument.phase('match.update'):
+            self.update(targets, **kwargs)
+        try:
+            with instrument.phase('match.madx'):
+                jmadMatchResult = self._model._jmadModel.match(self._jmadRequest)
+            return MatchResult(jmadMatchResult)
+        finally:
+            self._model._state.touch()
+
+    def __repr__(self):
+        return 'PreparedMatch(targets=' + repr(dict(self._targets)) + ', varies=' + repr(self._varies) + ')'
+
+
 class Strengths(MutableMapping):
-    def __init__(self, jmadModel):
+    def __init__(self, jmadModel, state=None):
         self._jmadStrengthVarSet = jmadModel.getStrengthsAndVars()
         self._jmadModel = jmadModel
+        self._state = state if state is not None else _ModelState()
 
     def __getitem__(self, k):
+        pending = self._state.pending_strengths
+        if pending is not None and k in pending:
+            return pending[k]
         jmadStrength = self._jmadStrengthVarSet.getStrength(k)
+        if jmadStrength is None:
+            jmadStrength = self._state.created_strengths.get(k)
         if jmadStrength is None:
             raise KeyError('Invalid Strength Name: ' + k)
         return jmadStrength.getValue()
 
     def __setitem__(self, k, v):
+        pending = self._state.pending_strengths
+        if pending is not None:
+            pending[k] = float(v)
+            return
         jmadStrength = self._jmadStrengthVarSet.getStrength(k)
+        if jmadStrength is None:
+            jmadStrength = self._state.created_strengths.get(k)
         if jmadStrength is None:
             logging.info("Creating new MAD-X strength " + k)
-            SimpleStrength = cern.accsoft.steering.jmad.domain.knob.strength.SimpleStrength
-            jmadStrength = SimpleStrength(k, 0.0, None)
-            jmadStrength.addListener(self._jmadModel.strengthListener)
+            jmadStrength = self._create(k)
+        self._state.touch()
         return jmadStrength.setValue(float(v))
 
+    def update(self, *args, **kwargs):
+        with self.batch():
+            MutableMapping.update(self, *args, **kwargs)
+
+    @contextmanager
+    def batch(self):
+        if self._state.pending_strengths is not None:
+            # nested batch - joins the outer one
+            yield self
+            return
+        self._state.pending_strengths = OrderedDict()
+        try:
+            yield self
+        except BaseException:
+            self._state.pending_strengths = None
+            raise
+        pending, self._state.pending_strengths = self._state.pending_strengths, None
+        self._commit(pending)
+
+    def to_series(self):
+        names, values = self._bulk_values()
+        return pd.Series(values, index=names, name='strength')
+
+    def values_array(self, names=None):
+        if names is None:
+            return self._bulk_values()[1]
+        if isinstance(names, str):
+            names = [names, ]
+        index = self._index()
+        pending = self._state.pending_strengths or {}
+        values = np.empty(len(names))
+        for i, k in enumerate(names):
+            if k in pending:
+                values[i] = pending[k]
+                continue
+            jmadStrength = self._jmad_strength(k, index)
+            if jmadStrength is None:
+                raise KeyError('Invalid Strength Name: ' + k)
+            values[i] = jmadStrength.getValue()
+        return values
+
+    def set_array(self, names, values):
+        if isinstance(names, str):
+            names = [names, ]
+        values = np.broadcast_to(np.asarray(values, dtype=float), (len(names),))
+        with self.batch():
+            pending = self._state.pending_strengths
+            for k, v in zip(names, values):
+                pending[k] = float(v)
+
+    def _bulk_values(self):
+        # one pass over the Java strengths, refreshing the name -> strength index on the way
+        index = OrderedDict()
+        values = []
+        for jmadStrength in self._jmadStrengthVarSet.getStrengths():
+            index[str(jmadStrength.getName())] = jmadStrength
+            values.append(jmadStrength.getValue())
+        for k, jmadStrength in self._state.created_strengths.items():
+            if k not in index:
+                index[k] = jmadStrength
+                values.append(jmadStrength.getValue())
+        self._state.strength_index = index
+        names = np.array(list(index.keys()), dtype=object)
+        values = np.array(values, dtype=float)
+        pending = self._state.pending_strengths
+        if pending:
+            for i, k in enumerate(names):
+                if k in pending:
+                    values[i] = pending[k]
+        return names, values
+
+    def _index(self):
+        if self._state.strength_index is None:
+            index = OrderedDict((str(s.getName()), s) for s in self._jmadStrengthVarSet.getStrengths())
+            for k, jmadStrength in self._state.created_strengths.items():
+                index.setdefault(k, jmadStrength)
+            self._state.strength_index = index
+        return self._state.strength_index
+
+    def _jmad_strength(self, k, index):
+        jmadStrength = index.get(k)
+        if jmadStrength is None:
+            jmadStrength = self._jmadStrengthVarSet.getStrength(k)
+            if jmadStrength is not None:
+                index[k] = jmadStrength
+        return jmadStrength
+
+    def _create(self, k):
+        SimpleStrength = cern.accsoft.steering.jmad.domain.knob.strength.SimpleStrength
+        jmadStrength = SimpleStrength(k, 0.0, None)
+        jmadStrength.addListener(self._jmadModel.strengthListener)
+        self._state.created_strengths[k] = jmadStrength
+        if self._state.strength_index is not None:
+            self._state.strength_index[k] = jmadStrength
+        return jmadStrength
+
+    def _commit(self, values):
+        index = self._index()
+        jmadStrengths = OrderedDict()
+        missing = []
+        for k in values:
+            jmadStrength = self._jmad_strength(k, index)
+            if jmadStrength is None:
+                missing.append(k)
+            else:
+                jmadStrengths[k] = jmadStrength
+        if missing:
+            logging.info("Creating new MAD-X strengths " + ', '.join(missing))
+            for k in missing:
+                jmadStrengths[k] = self._create(k)
+        previous = OrderedDict((k, jmadStrength.getValue()) for k, jmadStrength in jmadStrengths.items())
+        # each changed strength notifies the model exactly once, unchanged ones not at all
+        changed = [k for k in values if k in missing or values[k] != previous[k]]
+        if not changed:
+            return
+        applied = []
+        try:
+            for k in changed:
+                jmadStrengths[k].setValue(values[k])
+                applied.append(k)
+        except Exception:
+            logging.warning("Failed to commit strengths, rolling back " + str(len(applied)) + " changes")
+            for k in reversed(applied):
+                jmadStrengths[k].setValue(previous[k])
+            raise
+        finally:
+            self._state.touch()
+
     def __delitem__(self, k):
         raise NotImplementedError('Deletion of Strengths is not supported')
 
@@ -448,58 +827,142 @@ class Strengths(MutableMapping):
 
 
 class Elements(Mapping):
-    def __init__(self, elements):
-        from .element import from_jmad
-        if type(elements) is cern.accsoft.steering.jmad.domain.machine.Range:
-            self._elementList = [from_jmad(e) for e in elements.getElements()]
+    def __init__(self, elements, state=None, indices=None):
+        from .element import _ElementTable
+        self._state = state if state is not None else _ModelState()
+        if isinstance(elements, _ElementTable):
+            self._table = elements
+        elif type(elements) is cern.accsoft.steering.jmad.domain.machine.Range:
+            self._table = _ElementTable.from_range(elements, self._state)
         elif type(elements) is list:
-            self._elementList = elements
+            self._table = _ElementTable.from_elements(elements, self._state)
         else:
             raise ValueError('Expecting either a list of elements or a JMad Range')
-        self._nameDict = {}
-        for i, e in enumerate(self._elementList):
-            self._nameDict.setdefault(e.name, []).append(i)
+        if indices is None:
+            self._indices = np.arange(len(self._table))
+            self._names = self._table.name_index
+        else:
+            self._indices = np.asarray(indices, dtype=int)
+            self._names = None
+        self._sliced = indices is not None
+        self._positions = None
+
+    @property
+    def _nameDict(self):
+        if self._names is None:
+            self._names = {}
+            for i, name in enumerate(self._table.names[self._indices]):
+                self._names.setdefault(name, []).append(i)
+        return self._names
+
+    def _element(self, i):
+        return self._table.element(self._indices[i])
 
     def __getitem__(self, k):
-        if type(k) is int:
-            return self._elementList[k]
+        if isinstance(k, (int, np.integer)):
+            return self._element(k)
         if type(k) is slice:
             if type(k.start) in (int, type(None)) and type(k.stop) in (int, type(None)) \
                     and type(k.step) in (int, type(None)):
-                return self._elementList[k]
+                return [self._table.element(i) for i in self._indices[k]]
             else:
-                first_name = k.start if k.start is not None else self._elementList[0]
-                last_name = k.stop if k.stop is not None else self._elementList[-1]
-                first_idx = self._nameDict[first_name]
-                if type(first_idx) is list:
-                    first_idx = first_idx[0]
-                last_idx = self._nameDict[last_name]
-                if type(last_idx) is list:
-                    last_idx = last_idx[-1]
+                first_idx = self._nameDict[k.start][0] if k.start is not None else 0
+                last_idx = self._nameDict[k.stop][-1] if k.stop is not None else len(self) - 1
                 if first_idx > last_idx:
-                    elements = self._elementList[first_idx:] + self._elementList[:(last_idx + 1)]
+                    indices = np.concatenate((self._indices[first_idx:], self._indices[:(last_idx + 1)]))
                 else:
-                    elements = self._elementList[first_idx:(last_idx + 1)]
-                return Elements(elements)
-        matchingElements = [self._elementList[i] for i in self._nameDict[k]]
+                    indices = self._indices[first_idx:(last_idx + 1)]
+                return Elements(self._table, self._state, indices)
+        matchingElements = [self._element(i) for i in self._nameDict[k]]
         if len(matchingElements) == 1:
             return matchingElements[0]
         else:
             return matchingElements
 
     def __iter__(self):
-        return list(self._nameDict.keys())
+        return iter(self._nameDict.keys())
+
+    def __contains__(self, k):
+        return k in self._nameDict
+
+    def keys(self):
+        return self._nameDict.keys()
 
     def items(self):
-        for e in self._elementList:
+        for i in range(len(self)):
+            e = self._element(i)
             yield (e.name, e)
 
     def values(self):
-        for e in self._elementList:
-            yield e
+        for i in range(len(self)):
+            yield self._element(i)
 
     def __len__(self):
-        return len(self._elementList)
+        return len(self._indices)
+
+    def to_frame(self, attributes=()):
+        from .element import ELEMENT_TYPES
+        if isinstance(attributes, str):
+            attributes = [attributes, ]
+        data = OrderedDict()
+        data['type'] = self._table.madx_types[self._indices]
+        data['element_class'] = np.array(ELEMENT_TYPES, dtype=object)[self._table.type_codes[self._indices]]
+        data['position'] = self._table.positions[self._indices]
+        data['length'] = self._table.lengths[self._indices]
+        for attribute in attributes:
+            data[attribute] = self._table.attribute_column(attribute, self._indices)
+        return pd.DataFrame(data, index=self._table.names[self._indices], columns=list(data.keys()))
+
+    def _position_index(self):
+        if self._positions is None:
+            # the index of the whole range is kept on the shared element table
+            self._positions = self._table.position_index(self._indices if self._sliced else None)
+        return self._positions
+
+    def at(self, s):
+        found = self._position_index().lookup(s)
+        if np.ndim(s) == 0:
+            return self._element(found) if found >= 0 else None
+        names = np.full(found.shape, None, dtype=object)
+        names[found >= 0] = self._table.names[self._indices[found[found >= 0]]]
+        return names
+
+    def between(self, s0, s1):
+        return Elements(self._table, self._state, self._indices[self._position_index().between(s0, s1)])
+
+    def attribute_array(self, name, types=('Quadrupole',)):
+        from .element import _type_codes
+        codes = _type_codes(types)
+        indices = self._indices[np.isin(self._table.type_codes[self._indices], codes)]
+        return pd.Series(self._table.attribute_array(name, codes, indices), index=self._table.names[indices],
+                         name=name)
+
+    def set_attribute_array(self, name, names_or_mask, values):
+        from .element import AttributeChange
+        selector = np.asarray(names_or_mask)
+        if selector.dtype == bool:
+            if selector.shape != (len(self),):
+                raise ValueError('Expecting a mask of ' + str(len(self)) + ' elements, got shape ' +
+                                 str(selector.shape))
+            positions = np.nonzero(selector)[0]
+            values = np.broadcast_to(np.asarray(values, dtype=float), positions.shape)
+        else:
+            names = np.atleast_1d(selector)
+            name_values = np.broadcast_to(np.asarray(values, dtype=float), names.shape)
+            positions = []
+            values = []
+            for k, v in zip(names, name_values):
+                if k not in self._nameDict:
+                    raise KeyError('Invalid Element Name: ' + str(k))
+                # an element name occurring several times sets all its occurrences
+                positions.extend(self._nameDict[k])
+                values.extend([v] * len(self._nameDict[k]))
+            values = np.array(values, dtype=float)
+        if np.isnan(values).any():
+            raise ValueError('Cannot set ' + name + ' to NaN')
+        indices = self._indices[np.asarray(positions, dtype=int)]
+        previous = self._table.set_attribute_column(name, indices, values)
+        return AttributeChange(self._table, name, indices, previous, np.array(values))
 
     def _ipython_key_completions_(self):
         return list(self._nameDict.keys())
@@ -528,7 +991,13 @@ class Elements(Mapping):
 class _JMadVariableRepository(object):
     def __init__(self, variable_class):
         self._jmadClass = variable_class
-        self._jmadVars = {v.getName().upper(): v for v in variable_class.values()}
+        self._vars = None
+
+    @property
+    def _jmadVars(self):
+        if self._vars is None:
+            self._vars = {v.getName().upper(): v for v in self._jmadClass.values()}
+        return self._vars
 
     def _jmad_variable(self, var):
         if isinstance(var, str):
@@ -537,8 +1006,8 @@ class _JMadVariableRepository(object):
             return var
 
     def __getattr__(self, name):
-        if name == '_jmadVars':
-            return self._jmadVars
+        if name.startswith('_'):
+            raise AttributeError(name)
         if name.upper() in self._jmadVars:
             return name.upper()
 
@@ -546,14 +1015,51 @@ class _JMadVariableRepository(object):
         return self._jmadVars.keys()
 
 
-MadxTwissVariable = _JMadVariableRepository(cern.accsoft.steering.jmad.domain.var.enums.MadxTwissVariable)
-MadxGlobalVariable = _JMadVariableRepository(cern.accsoft.steering.jmad.domain.var.enums.MadxGlobalVariable)
+MadxTwissVariable = _JMadVariableRepository(JavaClass('cern.accsoft.steering.jmad.domain.var.enums.MadxTwissVariable'))
+MadxGlobalVariable = _JMadVariableRepository(
+    JavaClass('cern.accsoft.steering.jmad.domain.var.enums.MadxGlobalVariable'))
+
+class TfsResult(namedtuple('TfsResult', ['summary', 'data'])):
+    __slots__ = ()
 
-TfsResult = namedtuple('TfsResult', ['summary', 'data'])
+    def save(self, path, append=False):
+        from .storage import save_twiss
+        save_twiss(path, self, append)
+
+
+def load_twiss(path, mmap=True):
+    from .storage import load_twiss
+    return load_twiss(path, mmap)
+
+
+TFS_OUTPUTS = ('pandas', 'dict', 'structured')
 
 
 def _jmad_TfsResult_to_pandas(tfs_result):
-    summ = tfs_result.getSummary()
+    return _jmad_TfsResult_convert(tfs_result, 'pandas')
+
+
+def _jmad_TfsResult_convert(tfs_result, output='pandas'):
+    if output not in TFS_OUTPUTS:
+        raise ValueError('Invalid output: ' + str(output) + ' - expected one of ' + str(TFS_OUTPUTS))
+    return _tfs_columns_convert(_jmad_TfsSummary_to_dict(tfs_result.getSummary()),
+                                _jmad_TfsResult_columns(tfs_result), output)
+
+
+def _tfs_columns_convert(summ_dict, columns, output='pandas'):
+    if output not in TFS_OUTPUTS:
+        raise ValueError('Invalid output: ' + str(output) + ' - expected one of ' + str(TFS_OUTPUTS))
+    if output == 'dict':
+        data = columns
+    elif output == 'structured':
+        data = _columns_to_structured(columns)
+    else:
+        names = columns.pop('NAME')
+        data = pd.DataFrame(columns, index=names, columns=list(columns.keys()))
+    return TfsResult(summary=summ_dict, data=data)
+
+
+def _jmad_TfsSummary_to_dict(summ):
     summ_dict = {}
     for var in summ.getKeys():
         vt = str(summ.getVarType(var))
@@ -564,20 +1070,54 @@ def _jmad_TfsResult_to_pandas(tfs_result):
         else:
             val = None
         summ_dict[var] = val
-    names = np.array(Iterables.toArray(tfs_result.getStringData('NAME'), java.lang.String().getClass())[:])
-    result_df = pd.DataFrame(index=names)
+    return summ_dict
+
+
+def _jmad_TfsResult_columns(tfs_result):
+    columns = OrderedDict()
+    columns['NAME'] = _java_strings_to_numpy(tfs_result.getStringData('NAME'))
     for var in tfs_result.getKeys():
         if var == 'NAME':
             continue
         vt = str(tfs_result.getVarType(var))
         if vt == 'STRING':
-            col = np.array(Iterables.toArray(tfs_result.getStringData(var), java.lang.String().getClass())[:])
+            col = _java_strings_to_numpy(tfs_result.getStringData(var))
         elif vt == 'DOUBLE':
-            col = np.array(Doubles.toArray(tfs_result.getDoubleData(var))[:])
+            col = _java_doubles_to_numpy(tfs_result.getDoubleData(var))
         else:
-            col = None
-        result_df[var] = col
-    return TfsResult(summary=summ_dict, data=result_df)
+            col = np.full(len(columns['NAME']), None, dtype=object)
+        columns[str(var)] = col
+    return columns
+
+
+def _java_doubles_to_numpy(jmadDoubles):
+    # one primitive double[] copy across the bridge; wrap it without copying again where
+    # JPype exposes the buffer protocol, otherwise fall back to a bulk slice
+    primitive = Doubles.toArray(jmadDoubles)
+    try:
+        return np.frombuffer(memoryview(primitive), dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.asarray(primitive[:], dtype=np.float64)
+
+
+def _java_strings_to_numpy(jmadStrings):
+    return np.array(Iterables.toArray(jmadStrings, java.lang.String().getClass())[:])
+
+
+def _columns_to_structured(columns):
+    n = len(columns['NAME'])
+    structured = np.empty(n, dtype=[(var, col.dtype) for var, col in columns.items()])
+    for var, col in columns.items():
+        structured[var] = col
+    return structured
+
+
+def _attach_thread_to_jvm():
+    # JPype < 0.7 requires explicit attachment of threads not created by the JVM
+    jpype = start_jvm()
+    isThreadAttached = getattr(jpype, 'isThreadAttachedToJVM', None)
+    if isThreadAttached is not None and not isThreadAttached():
+        jpype.attachThreadToJVM()
 
 
 def _unbox_double(v):
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+
+def settings_records(settings):
+    if isinstance(settings, pd.DataFrame):
+        for key, row in settings.iterrows():
+            yield key, row
+        return
+    if isinstance(settings, Mapping):
+        raise ValueError('Expecting an iterable of strength mappings or (key, mapping) pairs - '
+                         'use [settings] to replay a single record')
+    for index, record in enumerate(settings):
+        if isinstance(record, Mapping) or isinstance(record, pd.Series):
+            yield index, record
+        else:
+            key, record = record
+            yield key, record
+
+
+def _delta(record):
+    # missing values (e.g. NaN in a settings frame) mean "unchanged"
+    delta = {}
+    for k, v in record.items():
+        if v is None:
+            continue
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            raise ValueError('Non-numeric value ' + repr(v) + ' for strength ' + str(k) +
+                             ' - drop non-strength columns from the settings')
+        if not np.isnan(v):
+            delta[str(k)] = v
+    return delta
+
+
+def _twiss_sink(sink, append):
+    if sink is None or callable(sink):
+        return sink
+    from .storage import TwissArchive, save_twiss
+    if isinstance(sink, TwissArchive):
+        return lambda key, result: sink.append(result)
+    state = {'append': append}
+
+    def write(key, result):
+        save_twiss(sink, result, append=state['append'])
+        state['append'] = True
+
+    return write
+
+
+def iter_twiss(model, settings, variables, element_filter=None, output='pandas', sink=None, append=False,
+               restore=True):
+    if isinstance(variables, str):
+        variables = [variables, ]
+    write = _twiss_sink(sink, append)
+    strengths = model.strengths
+    initial = {}
+    result = None
+    version = None
+    try:
+        for key, record in settings_records(settings):
+            delta = _delta(record)
+            for k in delta:
+                if k not in initial:
+                    initial[k] = strengths.get(k)
+            strengths.update(delta)
+            if result is None or model._state.version != version:
+                result = model.twiss(variables, element_filter, output, cache=False)
+                version = model._state.version
+            if write is not None:
+                write(key, result)
+            yield key, result
+    finally:
+        if restore:
+            strengths.update({k: v for k, v in initial.items() if v is not None})
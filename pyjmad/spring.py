@@ -1,8 +1,7 @@
-import jpype
+from .jvm import JavaClass
 
-org = jpype.JPackage('org')
-AnnotationConfigApplicationContext = org.springframework.context.annotation.AnnotationConfigApplicationContext
-ClassPathXmlApplicationContext = org.springframework.context.support.ClassPathXmlApplicationContext
+AnnotationConfigApplicationContext = JavaClass('org.springframework.context.annotation.AnnotationConfigApplicationContext')
+ClassPathXmlApplicationContext = JavaClass('org.springframework.context.support.ClassPathXmlApplicationContext')
 
 class SpringApplicationContext(object):
     def __init__(self, configuration):
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+FORMAT = 'pyjmad-twiss'
+FORMAT_VERSION = 1
+_META = 'pyjmad-twiss.json'
+_SUMMARY = 'summary.jsonl'
+
+_write_lock = threading.Lock()
+
+
+def _result_columns(result):
+    data = result.data
+    if isinstance(data, pd.DataFrame):
+        columns = OrderedDict([('NAME', np.asarray(data.index, dtype=object))])
+        for var in data.columns:
+            columns[str(var)] = data[var].values
+    elif isinstance(data, np.ndarray) and data.dtype.names is not None:
+        columns = OrderedDict((var, data[var]) for var in data.dtype.names)
+    else:
+        columns = OrderedDict(data)
+    return columns
+
+
+def _split_columns(columns):
+    names = np.asarray(columns['NAME'], dtype=str)
+    numeric = OrderedDict()
+    strings = OrderedDict()
+    for var, col in columns.items():
+        if var == 'NAME':
+            continue
+        col = np.asarray(col)
+        if col.dtype.kind in 'fiub':
+            numeric[var] = col.astype(np.float64)
+        else:
+            strings[var] = col.astype(str)
+    return names, [var for var in columns if var != 'NAME'], numeric, strings
+
+
+def _to_json(value):
+    if isinstance(value, (np.generic,)):
+        return value.item()
+    return value
+
+
+class TwissArchive(object):
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self._mmap = mmap
+        self._meta = self._read_meta()
+        self._names = None
+        self._strings = {}
+        self._summary = None
+        self._name_index = None
+
+    def _read_meta(self):
+        with open(os.path.join(self.path, _META)) as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT or meta.get('version') != FORMAT_VERSION:
+            raise ValueError(self.path + ' is not a ' + FORMAT + ' archive of version ' + str(FORMAT_VERSION))
+        return meta
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def variables(self):
+        return list(self._meta['variables'])
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = np.load(self._file('NAME.npy'), mmap_mode='r' if self._mmap else None)
+        return self._names
+
+    def _string_column(self, var):
+        if var not in self._strings:
+            self._strings[var] = np.load(self._file(var + '.npy'), mmap_mode='r' if self._mmap else None)
+        return self._strings[var]
+
+    @property
+    def summary(self):
+        if self._summary is None:
+            with open(self._file(_SUMMARY)) as f:
+                rows = [json.loads(line) for _, line in zip(range(len(self)), f)]
+            self._summary = pd.DataFrame(rows, index=pd.RangeIndex(len(rows)))
+        return self._summary
+
+    def column(self, var):
+        var = str(var).upper()
+        if var not in self._meta['variables']:
+            raise KeyError('Variable ' + var + ' not stored in ' + self.path + ' - available: ' +
+                           str(self.variables))
+        shape = (len(self), self._meta['elements'])
+        if shape[0] == 0 or shape[1] == 0:
+            return np.empty(shape)
+        if self._mmap:
+            return np.memmap(self._file(var + '.f8'), dtype=np.float64, mode='r', shape=shape)
+        return np.fromfile(self._file(var + '.f8'), dtype=np.float64,
+                           count=shape[0] * shape[1]).reshape(shape)
+
+    def element_index(self, element):
+        if self._name_index is None:
+            self._name_index = {}
+            for i, name in enumerate(self.names):
+                self._name_index.setdefault(str(name), i)
+        return self._name_index[element]
+
+    def values(self, var, element):
+        return np.array(self.column(var)[:, self.element_index(element)])
+
+    def result(self, index, output='pandas'):
+        from .pyjmad import _tfs_columns_convert
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('result ' + str(index) + ' out of range for ' + str(len(self)) + ' stored results')
+        columns = OrderedDict([('NAME', np.asarray(self.names, dtype=object))])
+        for var in self._meta['columns']:
+            if var in self._meta['strings']:
+                columns[var] = np.asarray(self._string_column(var), dtype=object)
+            else:
+                columns[var] = np.array(self.column(var)[index])
+        summary = {k: v for k, v in self.summary.iloc[index].items() if not _is_missing(v)}
+        return _tfs_columns_convert(summary, columns, output)
+
+    def __getitem__(self, index):
+        return self.result(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.result(index)
+
+    def __len__(self):
+        return self._meta['count']
+
+    def append(self, result):
+        save_twiss(self.path, result, append=True)
+        self.reload()
+
+    def reload(self):
+        self._meta = self._read_meta()
+        self._summary = None
+
+    def __repr__(self):
+        return 'TwissArchive(' + self.path + ': ' + str(len(self)) + ' results x ' + \
+               str(self._meta['elements']) + ' elements, variables=' + str(self.variables) + ')'
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _remove_archive(path):
+    # the metadata goes first - an interrupted overwrite leaves no archive rather than a mix of old and new files
+    meta_path = os.path.join(path, _META)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return
+    os.remove(meta_path)
+    files = ['NAME.npy', _SUMMARY] + [var + '.f8' for var in meta.get('variables', [])] + \
+            [var + '.npy' for var in meta.get('strings', [])]
+    for name in files:
+        try:
+            os.remove(os.path.join(path, name))
+        except OSError:
+            pass
+
+
+def append_block(path, names, columns, numeric, strings, summaries, append=True):
+    count = len(summaries)
+    for var, block in numeric.items():
+        if np.shape(block) != (count, len(names)):
+            raise ValueError('Column ' + var + ' has shape ' + str(np.shape(block)) + ' - expected ' +
+                             str((count, len(names))))
+    with _write_lock:
+        meta_path = os.path.join(path, _META)
+        if append and os.path.exists(meta_path):
+            archive = TwissArchive(path, mmap=True)
+            meta = archive._meta
+            if meta['columns'] != list(columns):
+                raise ValueError('Cannot append results with columns ' + str(list(columns)) +
+                                 ' to ' + path + ' storing ' + str(meta['columns']))
+            if not np.array_equal(np.asarray(archive.names), names):
+                raise ValueError('Cannot append results of a different range to ' + path)
+            for var, col in strings.items():
+                if not np.array_equal(np.asarray(archive._string_column(var)), col):
+                    raise ValueError('Cannot append results with different ' + var + ' to ' + path)
+            mode = 'r+b'
+        else:
+            os.makedirs(path, exist_ok=True)
+            _remove_archive(path)
+            meta = {'format': FORMAT, 'version': FORMAT_VERSION, 'count': 0, 'elements': len(names),
+                    'columns': list(columns), 'variables': list(numeric.keys()), 'strings': list(strings.keys())}
+            np.save(os.path.join(path, 'NAME.npy'), names)
+            for var, col in strings.items():
+                np.save(os.path.join(path, var + '.npy'), col)
+            mode = 'wb'
+        # data beyond the stored count is left over from an interrupted append - overwrite it
+        offset = meta['count'] * meta['elements'] * 8
+        for var, block in numeric.items():
+            file_path = os.path.join(path, var + '.f8')
+            with open(file_path, mode if os.path.exists(file_path) else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                f.write(np.ascontiguousarray(block, dtype=np.float64).tobytes())
+        summary_lines = ''.join(json.dumps({k: _to_json(v) for k, v in s.items()}) + '\n' for s in summaries)
+        summary_bytes = summary_lines.encode('utf-8')
+        summary_path = os.path.join(path, _SUMMARY)
+        with open(summary_path, mode if os.path.exists(summary_path) else 'wb') as f:
+            f.seek(meta.get('summary_bytes', 0))
+            f.truncate()
+            f.write(summary_bytes)
+        meta['count'] += count
+        meta['summary_bytes'] = meta.get('summary_bytes', 0) + len(summary_bytes)
+        tmp_path = meta_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+
+def save_twiss(path, result, append=False):
+    names, columns, numeric, strings = _split_columns(_result_columns(result))
+    append_block(path, names, columns, OrderedDict((var, col[np.newaxis, :]) for var, col in numeric.items()),
+                 strings, [result.summary], append)
+
+
+def save_scan(path, scan, append=False):
+    names = np.asarray(scan.names, dtype=str)
+    numeric = OrderedDict((var, scan.data[:, :, i]) for i, var in enumerate(scan.variables))
+    summaries = []
+    for (_, point), (_, summary) in zip(scan.points.iterrows(), scan.summary.iterrows()):
+        values = OrderedDict((k, v) for k, v in summary.items() if not _is_missing(v))
+        values.update(point.items())
+        summaries.append(values)
+    append_block(path, names, list(scan.variables), numeric, OrderedDict(), summaries, append)
+
+
+def load_twiss(path, mmap=True):
+    return TwissArchive(path, mmap)
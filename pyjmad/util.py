@@ -1,3 +1,20 @@
 class HtmlDict(dict):
     def _repr_html_(self):
         return ''.join([s._repr_html_() for s in self.values()])
+
+
+class _ModelState(object):
+    def __init__(self):
+        self.version = 0
+        self.pending_strengths = None
+        self.strength_index = None
+        # name -> strengths created through pyjmad, which JMad does not add to the model's strength set
+        self.created_strengths = {}
+        self.element_table = None
+        self.response_cache = {}
+        self.twiss_reference = None
+        # (element name, attribute) -> (jmad element, value before the first write through pyjmad)
+        self.modified_attributes = {}
+
+    def touch(self):
+        self.version += 1
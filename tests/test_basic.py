@@ -38,3 +38,165 @@ def test_twiss():
     assert abs(res.data.BETY['IP5']-0.4) < 0.005
     assert np.all(np.abs(res.data.X) < 0.01)
     assert np.all(np.abs(res.data.Y) < 0.01)
+
+
+def test_twiss_output_modes():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    res = lhcModel.twiss(variables=('S', 'BETX', 'BETY'))
+    res_dict = lhcModel.twiss(variables=('S', 'BETX', 'BETY'), output='dict')
+    res_struct = lhcModel.twiss(variables=('S', 'BETX', 'BETY'), output='structured')
+    assert list(res_dict.data['NAME']) == list(res.data.index)
+    assert np.allclose(res_dict.data['BETX'], res.data.BETX)
+    assert np.allclose(res_struct.data['BETY'], res.data.BETY)
+    assert res_dict.summary['Q1'] == res.summary['Q1']
+
+
+def test_twiss_cache():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    res = lhcModel.twiss(variables=('S', 'BETX', 'BETY'))
+    hit = lhcModel.twiss(variables=('S', 'BETX', 'BETY'))
+    assert lhcModel.twiss_cache.stats.hits == 1
+    assert np.all(hit.data.BETX == res.data.BETX)
+    # results are copies - modifying one in place does not affect later hits
+    hit.data['BETX'] *= 0
+    assert np.all(lhcModel.twiss(variables=('S', 'BETX', 'BETY')).data.BETX == res.data.BETX)
+    lhcModel.strengths['dQx.b1'] = -0.03
+    res_after = lhcModel.twiss(variables=('S', 'BETX', 'BETY'))
+    assert lhcModel.twiss_cache.stats.misses == 2
+    assert abs(res_after.summary['Q1'] - (res.summary['Q1'] - 0.03)) < 0.005
+
+
+def test_twiss_async():
+    import asyncio
+
+    async def twiss():
+        jmad = pyjmad.JMad()
+        lhcModel = await jmad.create_model_async(
+            jmad.model_packs['jmad-modelpack-lhc'].branches['master'].models['LHC 2017'])
+        lhcModel.sequence = 'lhcb1'
+        lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+        return await lhcModel.twiss_async(variables=('S', 'BETX', 'BETY'))
+
+    res = asyncio.run(twiss())
+    assert abs(res.summary['Q1']-62.31) < 0.005
+
+
+def test_model_packs_async():
+    import asyncio
+
+    async def models():
+        jmad = pyjmad.JMad()
+        await jmad.model_packs.reload_async()
+        return await jmad.model_packs['jmad-modelpack-lhc'].branches['master'].models_async()
+
+    models = asyncio.run(models())
+    assert 'LHC 2017' in models
+
+
+def test_shared_services():
+    jmad = pyjmad.JMad()
+    jmad_again = pyjmad.JMad()
+    assert jmad_again.model_packs is jmad.model_packs
+    assert 'shared_services' in jmad_again.startup_times
+    headless = pyjmad.JMad(headless=True)
+    assert headless.model_packs is jmad.model_packs
+
+
+def test_model_definition_index():
+    jmad = pyjmad.JMad()
+    definitions = jmad.model_definitions
+    assert jmad.model_definitions is definitions
+    if len(definitions) > 0:
+        name = next(iter(definitions))
+        assert jmad._model_definition(name.lower()) is definitions[name]
+        assert definitions[name].optics == definitions[name].optics
+    jmad.model_packs.refresh()
+    assert jmad.model_definitions is not definitions
+
+
+def test_twiss_local():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    full = lhcModel.twiss(variables=('BETX', 'BETY')).data
+    local = lhcModel.twiss_local('MQXA.1L1', 'MQXA.1R1', ('BETX', 'BETY'))
+    assert local.data.index[0] == 'MQXA.1L1'
+    assert local.data.index[-1] == 'MQXA.1R1'
+    assert np.allclose(local.data.BETX, full.BETX['MQXA.1L1':'MQXA.1R1'])
+
+    lhcModel.strengths['on_x1'] = lhcModel.strengths['on_x1'] + 10
+    local = lhcModel.twiss_local('MQXA.1L1', 'MQXA.1R1', ('BETX', 'BETY'))
+    full = lhcModel.twiss(variables=('BETX', 'BETY')).data
+    assert np.allclose(local.data.BETX, full.BETX['MQXA.1L1':'MQXA.1R1'], rtol=1e-4)
+    assert lhcModel.range == 'ALL'
+
+    # a tune change leaks out of the range - the result still is the slice of the full ring
+    lhcModel.strengths['dQx.b1'] = -0.02
+    local = lhcModel.twiss_local('MQXA.1L1', 'MQXA.1R1', ('BETX', 'BETY'))
+    full = lhcModel.twiss(variables=('BETX', 'BETY')).data
+    assert np.allclose(local.data.BETX, full.BETX['MQXA.1L1':'MQXA.1R1'], rtol=1e-4)
+    last = full.index[-1]
+    across = lhcModel.twiss_local(last, 'MQXA.1R1', ('BETX', ))
+    assert list(across.data.index) == [last] + list(full.index[:list(full.index).index('MQXA.1R1') + 1])
+    assert lhcModel.range == 'ALL'
+
+
+def test_profile():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    with pyjmad.profile() as p:
+        lhcModel.twiss(variables=('S', 'BETX'), cache=False)
+        lhcModel.strengths['on_x1']
+    stats = p.stats
+    assert stats.loc['Model.twiss', 'calls'] == 1
+    assert stats.loc['phase twiss.madx', 'calls'] == 1
+    assert stats.loc['Strengths.__getitem__', 'calls'] == 1
+    assert 'phase twiss.convert' in p.report()
+    assert not pyjmad.instrument.is_enabled()
+
+
+def test_overlapping_profiles():
+    first = pyjmad.profile()
+    second = pyjmad.profile()
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert pyjmad.instrument.is_enabled()
+    second.__exit__(None, None, None)
+    assert not pyjmad.instrument.is_enabled()
+
+
+def test_profile_records_own_thread_only():
+    import threading
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    with pyjmad.profile() as p:
+        other = threading.Thread(target=lambda: lhcModel.strengths['on_x1'])
+        other.start()
+        other.join()
+        lhcModel.twiss(variables=('S', ), cache=False)
+    assert 'Model.twiss' in p.stats.index
+    assert 'Strengths.__getitem__' not in p.stats.index
+
+
+def test_lazy_jvm_startup():
+    import subprocess, sys
+    code = ('import pyjmad\n'
+            'from pyjmad.matching import GlobalConstraint\n'
+            'assert not pyjmad.is_jvm_started()\n'
+            'pyjmad.configure_jvm("-Xmx1g")\n'
+            'pyjmad.JMad()\n'
+            'assert pyjmad.is_jvm_started()\n')
+    subprocess.check_call([sys.executable, '-c', code])
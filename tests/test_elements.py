@@ -2,6 +2,7 @@
 
 import pyjmad
 import numpy as np
+import pytest
 from .models import *
 
 def test_slice_elements():
@@ -28,3 +29,141 @@ def test_set_quatrupole():
     # assert beta-beating
     assert np.sqrt(np.mean((res_before.data.BETX/res_after.data.BETX-1)**2)) > 0.3
     assert np.sqrt(np.mean((res_before.data.BETY/res_after.data.BETY-1)**2)) < 0.05
+
+
+def test_elements_table_is_cached():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements
+    assert lhcModel.elements._table is elements._table
+    assert elements['MQ.10L3.B1'] is lhcModel.elements['MQ.10L3.B1']
+    assert 'IP1' in elements
+    assert elements[0].name == list(elements.keys())[0]
+
+
+def test_elements_to_frame():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements['BPM.10L1.B1':'BPM.10R1.B1']
+    layout = elements.to_frame(attributes=['k1', 'angle', 'tilt'])
+    assert len(layout) == len(elements)
+    assert list(layout.columns) == ['type', 'element_class', 'position', 'length', 'k1', 'angle', 'tilt']
+    assert layout.type['MQ.10L1.B1'] == elements['MQ.10L1.B1'].type
+    assert layout.element_class['MQ.10L1.B1'] == 'Quadrupole'
+    assert layout.k1['MQ.10L1.B1'] == elements['MQ.10L1.B1'].k1
+    assert np.isnan(layout.k1['BPM.10L1.B1'])
+    with pytest.raises(ValueError):
+        elements.to_frame(attributes=['kl1'])
+
+
+def test_elements_attribute_array():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements
+    k1 = elements.attribute_array('k1')
+    assert len(k1) == (elements.to_frame().element_class == 'Quadrupole').sum()
+    assert k1['MQ.10L3.B1'] == elements['MQ.10L3.B1'].k1
+    elements['MQ.10L3.B1'].k1 = 0.01
+    assert elements.attribute_array('k1')['MQ.10L3.B1'] == 0.01
+    kicks = elements['BPM.10L1.B1':'BPM.10R1.B1'].attribute_array('h_kick', types='Corrector')
+    assert 'MCBCH.10L1.B1' in kicks.index
+
+
+def test_elements_set_attribute_array():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements
+    k1 = elements.attribute_array('k1')
+    change = elements.set_attribute_array('k1', k1.index, k1.values * 1.001)
+    assert len(change) == len(k1)
+    assert np.allclose(elements.attribute_array('k1').values, k1.values * 1.001)
+    change.undo()
+    assert np.allclose(elements.attribute_array('k1').values, k1.values)
+    with pytest.raises(ValueError):
+        elements.set_attribute_array('k1', ['MQ.10L3.B1', 'BPM.10L1.B1'], 0.01)
+    assert elements['MQ.10L3.B1'].k1 == k1['MQ.10L3.B1']
+    with pytest.raises(ValueError):
+        elements.set_attribute_array('k1', ['MQ.10L3.B1'], np.nan)
+
+
+def test_elements_set_attribute_array_rollback_and_undo(monkeypatch):
+    import pyjmad.element
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements
+    names = ['MQ.10L3.B1', 'MQ.11L3.B1', 'MQ.12L3.B1']
+    k1 = [elements[n].k1 for n in names]
+
+    setter = pyjmad.element._attribute_setter
+    calls = []
+
+    def failing_setter(element_class, attribute):
+        set_value = setter(element_class, attribute)
+
+        def set_or_fail(jmadElement, value):
+            # the third write fails, the rollback writes go through
+            calls.append(value)
+            if len(calls) == 3:
+                raise RuntimeError('write failed')
+            set_value(jmadElement, value)
+        return set_or_fail
+
+    monkeypatch.setattr(pyjmad.element, '_attribute_setter', failing_setter)
+    with pytest.raises(RuntimeError):
+        elements.set_attribute_array('k1', names, 0.01)
+    monkeypatch.undo()
+    assert [elements[n].k1 for n in names] == k1
+    assert not lhcModel._state.modified_attributes
+
+    change = elements.set_attribute_array('k1', names[:2], 0.01)
+    # a previous value that could not be read is not written back
+    change.previous[1] = np.nan
+    change.undo()
+    assert elements[names[0]].k1 == k1[0]
+    assert elements[names[1]].k1 == 0.01
+
+
+def test_elements_by_position():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    elements = lhcModel.elements
+    quad = elements['MQ.10L3.B1']
+    assert elements.at(quad.position) is quad
+    assert list(elements.at([quad.position, quad.position + quad.length / 4])) == ['MQ.10L3.B1', 'MQ.10L3.B1']
+    ir1 = elements.between(elements['BPM.10L1.B1'].position, elements['BPM.10R1.B1'].position)
+    assert 'IP1' in ir1
+    assert set(elements['BPM.10L1.B1':'BPM.10R1.B1'].keys()) <= set(ir1.keys())
+    length = lhcModel.twiss(variables=()).summary['LENGTH']
+    assert 'IP1' in elements.between(length - 1, 1)
+    assert elements.at(length + quad.position) is quad
+
+
+def test_elements_by_position_in_sub_range():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = [r for r in lhcModel.sequence.ranges if r != 'ALL'][0]
+    elements = lhcModel.elements
+    element = elements[len(elements) // 2]
+    found = elements.at(element.position)
+    assert found is not None and abs(found.position - element.position) <= found.length / 2
+    assert element.name in elements.between(element.position - 1, element.position + 1)
@@ -42,3 +42,39 @@ def test_match_local_beta():
     res = lhcModel.twiss(variables=('S', 'BETX', 'BETY'))
     assert abs(res.data.BETX['IP1']-0.45) < 0.005
     assert abs(res.data.BETY['IP1']-0.45) < 0.005
+
+
+def test_match_many_tunes():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    initial = lhcModel.strengths['KQT4.L3']
+    targets = [{'Q1': q1, 'Q2': 60.31} for q1 in (62.27, 62.28, 62.29)]
+    results = lhcModel.match_many(targets, [Vary('KQT4.L3', step=0.000001),
+                                            Vary('KQT4.R3', step=0.000001)])
+    assert len(results) == 3
+    assert list(results['target'].columns) == ['Q1', 'Q2']
+    assert results['error'].isnull().all()
+    assert (results['penalty'] < 1e-5).all()
+    assert len(results['vary'].columns) == 2
+    assert lhcModel.strengths['KQT4.L3'] == initial
+
+
+def test_prepared_match():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    tune_match = lhcModel.prepare_match(GlobalConstraint(Q1=62.28, Q2=60.31),
+                                        Vary('KQT4.L3', step=0.000001),
+                                        Vary('KQT4.R3', step=0.000001))
+    assert list(tune_match.targets) == ['Q1', 'Q2']
+    for q1 in (62.28, 62.29):
+        mr = tune_match(Q1=q1)
+        assert mr.final_penalty < 1e-5
+        summary = lhcModel.twiss(variables=()).summary
+        assert abs(summary['Q1'] - q1) < 0.005
+        assert abs(summary['Q2'] - 60.31) < 0.005
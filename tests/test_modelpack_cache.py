@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from pyjmad.modelpack import JMadModelPackService
+
+
+class _Blocking(object):
+    def __init__(self, supplier):
+        self._supplier = supplier
+
+    def collectList(self):
+        return self
+
+    def block(self):
+        return self._supplier()
+
+
+class _Value(object):
+    def __init__(self, **values):
+        for k, v in values.items():
+            setattr(self, k, (lambda v: lambda: v)(v))
+
+
+class _LocalRepositoryService(object):
+    """Stand-in for the Java model pack service, serving one local repository."""
+
+    def __init__(self):
+        self.repository = _Value(connectorId='gitlab-group-api-v4', baseUrl='file:///local', repoName='packs')
+        self.fetches = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def availablePackages(self):
+        def fetch():
+            self.release.wait()
+            self.fetches += 1
+            package = _Value(name='local-pack', repository=self.repository)
+            return [_Value(modelPackage=package, variant=_Value(type='BRANCH', name=branch),
+                           fullName='local-pack-' + branch) for branch in ('master', 'dev')]
+
+        return _Blocking(fetch)
+
+    def modelDefinitionsFrom(self, variant):
+        return _Blocking(lambda: [])
+
+    def clearCache(self):
+        return _Blocking(lambda: None)
+
+    def enabledRepositories(self):
+        return _Blocking(lambda: [self.repository])
+
+
+def _context(service):
+    return {'jmadModelPackageService': service, 'packageRepositoryManager': service}
+
+
+def test_modelpack_listing_cache(tmpdir):
+    cache_path = str(tmpdir.join('modelpacks.json'))
+    service = _LocalRepositoryService()
+    modelpacks = JMadModelPackService(_context(service), cache_path=cache_path)
+    assert service.fetches == 1
+    assert sorted(modelpacks['local-pack'].branches.keys()) == ['dev', 'master']
+
+    # second start is served from the disk cache and refreshes in the background
+    service.release.clear()
+    cached = JMadModelPackService(_context(service), cache_path=cache_path)
+    assert sorted(cached['local-pack'].branches.keys()) == ['dev', 'master']
+    assert service.fetches == 1
+    service.release.set()
+    assert cached['local-pack'].branches['master'].models == {}
+    assert service.fetches == 2
+
+    # an expired cache blocks on the repository again
+    JMadModelPackService(_context(service), cache_path=cache_path, cache_ttl=-1)
+    assert service.fetches == 3
+
+    cached.refresh()
+    assert service.fetches == 4
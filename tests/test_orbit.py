@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import pyjmad
+import numpy as np
+
+from .models import *
+
+
+def test_response_matrix_and_correction():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    layout = lhcModel.elements.to_frame()
+    correctors = list(layout[layout.type.isin(['HKICKER', 'KICKER'])].index[:4])
+    monitors = list(layout[layout.element_class == 'Monitor'].index[:20])
+    kicks = [lhcModel.elements[c].h_kick for c in correctors]
+
+    response = lhcModel.response_matrix(correctors, monitors, plane='H')
+    assert response.shape == (20, 4)
+    assert list(response.columns) == correctors
+    assert np.abs(response.values).max() > 0
+    assert [lhcModel.elements[c].h_kick for c in correctors] == kicks
+    assert np.allclose(lhcModel.response_matrix(correctors, monitors, plane='H'), response)
+
+    lhcModel.elements[correctors[1]].h_kick = kicks[1] + 1e-5
+    correction = lhcModel.correct_orbit(plane='H', correctors=correctors, monitors=monitors)
+    assert abs(correction.kicks[correctors[1]] + 1e-5) < 1e-7
+    assert abs(lhcModel.elements[correctors[1]].h_kick - kicks[1]) < 1e-7
+
+
+def test_default_correctors_follow_plane():
+    from pyjmad.orbit import _element_names, _CORRECTOR_TYPES
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    layout = lhcModel.elements.to_frame()
+    horizontal = _element_names(lhcModel, None, 'Corrector', _CORRECTOR_TYPES['X'])
+    vertical = _element_names(lhcModel, None, 'Corrector', _CORRECTOR_TYPES['Y'])
+    assert set(layout.type[horizontal]) <= {'HKICKER', 'KICKER'}
+    assert set(layout.type[vertical]) <= {'VKICKER', 'KICKER'}
+    assert 'MCBH.14R1.B1' in horizontal and 'MCBH.14R1.B1' not in vertical
+
+
+def test_response_matrix_follows_model_state():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    layout = lhcModel.elements.to_frame()
+    correctors = list(layout[layout.type.isin(['HKICKER', 'KICKER'])].index[:2])
+    monitors = list(layout[layout.element_class == 'Monitor'].index[:10])
+    response = lhcModel.response_matrix(correctors, monitors, plane='H')
+    assert not lhcModel._state.modified_attributes
+    assert lhcModel.checkpoint().attribute_names.size == 0
+
+    lhcModel.elements['MQ.10L3.B1'].k1 = 0.01
+    changed = lhcModel.response_matrix(correctors, monitors, plane='H')
+    assert not np.allclose(changed, response)
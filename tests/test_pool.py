@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+import pyjmad
+
+from .models import *
+
+
+def test_model_pool_restores_baseline():
+    jmad = pyjmad.JMad()
+    model_def = jmad.model_packs['jmad-modelpack-lhc'].branches['master'].models['LHC 2017']
+    pool = pyjmad.ModelPool(jmad, model_def, optic='R2017a_A40C40A10mL300_CTPPS2', sequence='lhcb1',
+                            range='ALL', size=2)
+    tunes = []
+
+    def worker():
+        with pool.model() as lhcModel:
+            assert lhcModel.strengths['dQx.b1'] == 0.0
+            lhcModel.strengths['dQx.b1'] = -0.03
+            tunes.append(lhcModel.twiss(variables=()).summary['Q1'])
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(tunes) == 4
+    assert all(abs(q - 62.28) < 0.005 for q in tunes)
+    assert pool.stats.checkouts == 4
+    assert pool.stats.available == 2
+
+
+def test_model_pool_replaces_broken_models(monkeypatch):
+    jmad = pyjmad.JMad()
+    model_def = jmad.model_packs['jmad-modelpack-lhc'].branches['master'].models['LHC 2017']
+    pool = pyjmad.ModelPool(jmad, model_def, optic='R2017a_A40C40A10mL300_CTPPS2', sequence='lhcb1',
+                            range='ALL', size=1)
+
+    def fail(*args):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(pool, '_restore', fail)
+    with pool.model() as lhcModel:
+        monkeypatch.setattr(lhcModel, 'reset', fail)
+        broken = lhcModel
+    assert pool.stats.size == 1
+
+    monkeypatch.setattr(pool, '_create_model', fail)
+    with pool.model() as lhcModel:
+        assert lhcModel is not broken
+        monkeypatch.setattr(lhcModel, 'reset', fail)
+    assert pool.stats.size == 0 and pool.stats.available == 0
+    with pytest.raises(RuntimeError):
+        with pool.model():
+            pass
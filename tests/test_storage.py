@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import pyjmad
+import numpy as np
+
+from .models import *
+
+
+def test_save_and_load_twiss(tmpdir):
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    path = str(tmpdir.join('twiss'))
+    first = lhcModel.twiss(variables=('S', 'KEYWORD', 'BETX', 'X'))
+    first.save(path)
+    lhcModel.strengths['on_x1'] = lhcModel.strengths['on_x1'] + 10
+    second = lhcModel.twiss(variables=('S', 'KEYWORD', 'BETX', 'X'))
+    second.save(path, append=True)
+
+    archive = pyjmad.load_twiss(path)
+    assert len(archive) == 2
+    assert list(archive[0].data.columns) == list(first.data.columns)
+    assert np.allclose(archive[1].data.X, second.data.X)
+    assert archive[1].summary['Q1'] == second.summary['Q1']
+    assert np.allclose(archive.values('X', 'IP1'), [first.data.X['IP1'], second.data.X['IP1']])
+    assert archive.column('BETX').shape == (2, len(first.data))
+
+
+def test_save_twiss_overwrites_archive(tmpdir):
+    import os
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    path = str(tmpdir.join('twiss'))
+    lhcModel.twiss(variables=('S', 'BETX', 'X')).save(path)
+    lhcModel.twiss(variables=('S', 'BETX', 'X')).save(path, append=True)
+    twiss = lhcModel.twiss(variables=('S', 'Y'))
+    twiss.save(path)
+
+    archive = pyjmad.load_twiss(path)
+    assert len(archive) == 1
+    assert archive.variables == ['S', 'Y']
+    assert not os.path.exists(os.path.join(path, 'BETX.f8'))
+    assert np.allclose(archive[0].data.Y, twiss.data.Y)
+
+
+def test_iter_twiss_to_archive(tmpdir):
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    initial = lhcModel.strengths['on_x1']
+    path = str(tmpdir.join('replay'))
+    settings = [('t0', {'on_x1': 100}), ('t1', {'on_x1': 100}), ('t2', {'on_x1': 150})]
+    results = list(lhcModel.iter_twiss(settings, variables=('S', 'X'), sink=path))
+    assert [key for key, _ in results] == ['t0', 't1', 't2']
+    assert results[0][1] is results[1][1]
+    assert lhcModel.strengths['on_x1'] == initial
+
+    archive = pyjmad.load_twiss(path)
+    assert len(archive) == 3
+    assert np.allclose(archive.values('X', 'IP1'), [twiss.data.X['IP1'] for _, twiss in results])
+
+
+def test_iter_twiss_rejects_non_numeric_settings():
+    import pandas as pd
+    import pytest
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    initial = lhcModel.strengths['on_x1']
+    settings = pd.DataFrame({'on_x1': [100., np.nan], 'comment': ['ramp', 'flat top']})
+    with pytest.raises(ValueError, match='comment'):
+        list(lhcModel.iter_twiss(settings.iterrows(), variables=('X', )))
+    assert lhcModel.strengths['on_x1'] == initial
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pyjmad
+import pickle
 import numpy as np
 
 from .models import *
@@ -65,4 +66,114 @@ def test_strength_manipulation_tune():
     summary = lhcModel.twiss(variables=()).summary
     assert abs(summary['Q1']-62.28) < 0.005
     assert abs(summary['Q2']-60.31) < 0.005
-	
\ No newline at end of file
+	
+
+def test_strength_batch_update():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    with lhcModel.strengths.batch():
+        lhcModel.strengths['dQx.b1'] = -0.03
+        lhcModel.strengths['dQy.b1'] = -0.01
+        assert lhcModel.strengths['dQx.b1'] == -0.03
+    summary = lhcModel.twiss(variables=()).summary
+    assert abs(summary['Q1']-62.28) < 0.005
+    assert abs(summary['Q2']-60.31) < 0.005
+
+    lhcModel.strengths.update({'dQx.b1': 0.0, 'dQy.b1': 0.0})
+    summary = lhcModel.twiss(variables=()).summary
+    assert abs(summary['Q1']-62.31) < 0.005
+    assert abs(summary['Q2']-60.32) < 0.005
+
+
+def test_strength_arrays():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    strengths = lhcModel.strengths.to_series()
+    assert len(strengths) == len(lhcModel.strengths)
+    assert strengths['on_x5'] == lhcModel.strengths['on_x5']
+
+    lhcModel.strengths.set_array(['on_x1', 'on_x5'], np.array([140., -140.]))
+    assert np.all(lhcModel.strengths.values_array(['on_x1', 'on_x5']) == [140., -140.])
+    assert lhcModel.strengths['on_x5'] == -140.
+
+
+def test_strength_created_in_batch():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    lhcModel.strengths.values_array(['on_x1'])
+    with lhcModel.strengths.batch():
+        lhcModel.strengths['on_test_knob'] = 1.5
+    assert np.all(lhcModel.strengths.values_array(['on_test_knob', 'on_x1']) ==
+                  [1.5, lhcModel.strengths['on_x1']])
+    lhcModel.strengths.set_array(['on_test_knob'], [2.5])
+    assert lhcModel.strengths.values_array(['on_test_knob'])[0] == 2.5
+    assert lhcModel.strengths.to_series()['on_test_knob'] == 2.5
+    assert lhcModel.strengths['on_test_knob'] == 2.5
+
+
+def test_strength_scan():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    scan = lhcModel.scan({'dQx.b1': [-0.03, 0.0], 'dQy.b1': [-0.01, 0.0]}, variables=('BETX', 'BETY'))
+    assert scan.data.shape == (4, len(scan.names), 2)
+    assert not scan.errors
+    assert abs(scan.summary.Q1[0]-62.28) < 0.005
+    assert abs(scan.summary.Q2[0]-60.31) < 0.005
+    assert lhcModel.strengths['dQx.b1'] == 0.0
+
+
+def test_strength_scan_workers_see_modified_attributes():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    lhcModel.elements['MQ.10L3.B1'].k1 = 0.01
+    grid = {'dQx.b1': [-0.01, 0.0]}
+    serial = lhcModel.scan(grid, variables=('BETX', ))
+    parallel = lhcModel.scan(grid, variables=('BETX', ), workers=2)
+    assert not parallel.errors
+    assert np.allclose(serial.data, parallel.data)
+
+
+def test_model_spec_pickles():
+    from pyjmad.parallel import model_spec
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    spec = model_spec(lhcModel)
+    assert pickle.loads(pickle.dumps(spec)) == spec
+    assert all(type(v) is str for v in (spec.definition, spec.optic, spec.sequence, spec.range))
+
+
+def test_checkpoint_restore():
+    jmad = pyjmad.JMad()
+    lhcModel = lhc_model_2017(jmad)
+    lhcModel.sequence = 'lhcb1'
+    lhcModel.optic = 'R2017a_A40C40A10mL300_CTPPS2'
+    lhcModel.range = 'ALL'
+    k1 = lhcModel.elements['MQ.10L3.B1'].k1
+    on_x1 = lhcModel.strengths['on_x1']
+    snap = lhcModel.checkpoint()
+    lhcModel.strengths['on_x1'] = on_x1 + 10
+    lhcModel.elements['MQ.10L3.B1'].k1 = 0.01
+    diff = snap.diff(lhcModel.checkpoint())
+    assert diff.loc[('strength', 'on_x1', ''), 'other'] == on_x1 + 10
+    assert lhcModel.restore(pickle.loads(pickle.dumps(snap))) >= 2
+    assert lhcModel.strengths['on_x1'] == on_x1
+    assert lhcModel.elements['MQ.10L3.B1'].k1 == k1
+    assert snap.diff(lhcModel.checkpoint()).empty